@@ -0,0 +1,311 @@
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import platform
+import shutil
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import generate_log
+import log_processing_engine as engine
+
+SIZES = "100K,1M,10M"
+SEED = 42
+CORRUPT_RATE = 0.05
+PROFILE = "uniform"   # generate_log.PROFILES workload, e.g. "production" for hot users and bursts
+DATA_DIR = "bench_data"   # generated inputs are kept here and reused by later runs
+BASELINE_FILE = "benchmark_baseline.json"
+RESULTS_FILE = "benchmark_results.json"
+TOLERANCE = 0.10   # a mode is a regression when its lines/sec drop more than this below the baseline
+REPEAT = 1   # runs per mode and size; the fastest one is kept
+SKETCH_CAPACITY = 1000
+PARALLEL_WORKERS = os.cpu_count() or 1
+SETUP_PHASES = ("index",)   # one-off preparation: timed and shown, but left out of lines/sec
+STDERR_LINES = 20   # lines of a failed mode's stderr shown
+
+
+# Every mode returns ({phase: seconds}, lines scanned or None for the whole input). Phases
+# are timed in the benchmarked process itself, which runs one mode on one input, so the
+# peak RSS it reports belongs to that mode alone.
+
+def timed(phases, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    phases[name] = time.perf_counter() - start
+    return result
+
+
+def bench_scan(filename, workers=1, engine_name="mmap", capacity=0, distinct=None):
+    # A serial scan goes through scan_instrumented, which times reading, parsing and counting
+    # apart (same result as scan_file); a pool scan can only be timed whole
+    phases = {}
+    if workers > 1:
+        aggregator = timed(phases, "scan", engine.scan_file, filename, workers, engine_name, capacity, 0, None,
+                           distinct)
+    else:
+        stats = engine.PhaseStats(os.path.getsize(filename))
+        aggregator = engine.scan_instrumented(filename, engine_name, capacity, distinct, stats=stats)
+        phases.update(stats.seconds)
+    timed(phases, "report", aggregator.result)
+    return phases, None
+
+
+def bench_numpy(filename):
+    phases = {}
+    timed(phases, "scan", engine.scan_numpy, filename)
+    return phases, None
+
+
+def bench_gzip(filename):
+    # The same log gzip-compressed (once, untimed) and scanned with streaming decompression
+    compressed = filename + ".gz"
+    if not os.path.exists(compressed):
+        with open(filename, "rb") as src, gzip.open(compressed + ".tmp", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(compressed + ".tmp", compressed)
+    return bench_scan(compressed)
+
+
+def bench_checkpoint(filename):
+    phases = {}
+    checkpoint = filename + ".bench.ckpt"
+    try:
+        aggregator = timed(phases, "scan", engine.scan_with_checkpoints, filename, checkpoint)
+        timed(phases, "report", aggregator.result)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(checkpoint)
+    return phases, None
+
+
+def bench_window(filename):
+    phases = {}
+    stats = timed(phases, "scan", engine.scan_windows, filename, "hour")
+    timed(phases, "report", stats.windows)
+    return phases, None
+
+
+def bench_time_range(filename):
+    # Index built from scratch (a setup phase), then one hour out of the middle of the log;
+    # lines/sec counts the lines of that hour (events and rejects), not the whole file
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(filename + ".idx")
+    phases = {}
+    timestamps, offsets = timed(phases, "index", engine.build_index, filename)
+    middle = timestamps[len(timestamps) // 2] if timestamps else 0
+    start, end = engine.format_minute(middle) + ":00", engine.format_minute(middle + 3600) + ":00"
+    aggregator = timed(phases, "query", engine.scan_time_range, filename, start, end)
+    timed(phases, "report", aggregator.result)
+    return phases, aggregator.total_events + aggregator.rejects.total()
+
+
+def bench_columnar(filename):
+    phases = {}
+    columnar = filename + ".bench.col"
+    try:
+        timed(phases, "convert", engine.convert_to_columnar, filename, columnar)
+        timed(phases, "query", engine.query_columnar, columnar)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(columnar)
+    return phases, None
+
+
+MODES = {
+    "text": lambda filename: bench_scan(filename, 1, "text"),
+    "mmap": lambda filename: bench_scan(filename, 1, "mmap"),
+    "mmap-parallel": lambda filename: bench_scan(filename, PARALLEL_WORKERS, "mmap"),
+    "numpy": bench_numpy,
+    "gzip": bench_gzip,
+    "sketch": lambda filename: bench_scan(filename, 1, "mmap", SKETCH_CAPACITY),
+    "distinct": lambda filename: bench_scan(filename, 1, "mmap", 0, "approx"),
+    "checkpoint": bench_checkpoint,
+    "window": bench_window,
+    "time-range": bench_time_range,
+    "columnar": bench_columnar,
+}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    scale = {"K": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9}.get(text[-1:], 1)
+    return int(float(text.rstrip("KMG")) * scale)
+
+
+def format_size(n):
+    for suffix, scale in (("G", 10 ** 9), ("M", 10 ** 6), ("K", 10 ** 3)):
+        if n >= scale and n % scale == 0:
+            return f"{n // scale}{suffix}"
+    return str(n)
+
+
+def input_file(lines, seed, corrupt_rate, data_dir=DATA_DIR, profile=PROFILE):
+    # Returns (path, seconds spent generating it, or None when it already existed)
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"logs_{format_size(lines)}_{profile}_seed{seed}_corrupt{corrupt_rate:g}.txt")
+    if os.path.exists(path):
+        return path, None
+
+    start = time.perf_counter()
+    generate_log.generate_file_bulk(path + ".tmp", lines, seed, corrupt_rate, profile)
+    os.replace(path + ".tmp", path)
+    return path, time.perf_counter() - start
+
+
+def run_mode(mode, filename):
+    # Child side: one mode on one file, reported as a single JSON line on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        phases, lines = MODES[mode](filename)
+
+    # ru_maxrss is in KiB on Linux; pool workers are counted by their own largest peak
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(json.dumps({"phases": phases, "lines": lines, "peak_rss_mb": round(peak / 1024, 1)}))
+
+
+def measure(mode, filename, lines):
+    # One mode in a fresh process; None (with the tail of its stderr shown) if it failed
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-mode", mode, filename],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if process.returncode:
+        print(f"FAILED {mode} on {filename} (exit status {process.returncode}):", file=sys.stderr)
+        print("\n".join(process.stderr.rstrip().splitlines()[-STDERR_LINES:]), file=sys.stderr)
+        return None
+    child = json.loads(process.stdout.strip().splitlines()[-1])
+    scanned = lines if child["lines"] is None else child["lines"]
+    seconds = sum(child["phases"].values())
+    scan_seconds = sum(value for name, value in child["phases"].items() if name not in SETUP_PHASES)
+    size = os.path.getsize(filename)
+    return {
+        "mode": mode,
+        "lines": lines,
+        "scanned_lines": scanned,
+        "bytes": size,
+        "seconds": round(seconds, 4),
+        "lines_per_sec": round(scanned / scan_seconds),
+        "mb_per_sec": round(size * scanned / lines / scan_seconds / 1e6, 2),   # bytes of the lines scanned, estimated
+        "peak_rss_mb": child["peak_rss_mb"],
+        "phases": {name: round(value, 4) for name, value in child["phases"].items()},
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Returns the (result, baseline lines/sec) pairs that got slower than the tolerance allows
+    previous = {(entry["lines"], entry["mode"]): entry["lines_per_sec"] for entry in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = previous.get((result["lines"], result["mode"]))
+        if base and result["lines_per_sec"] < base * (1 - tolerance):
+            regressions.append((result, base))
+    return regressions
+
+
+def print_result(result, baseline=None):
+    phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in result["phases"].items())
+    change = ""
+    if baseline:
+        base = baseline.get((result["lines"], result["mode"]))
+        if base:
+            change = f"{(result['lines_per_sec'] / base - 1) * 100:+7.1f}%"
+    print(f"{format_size(result['lines']):>6}  {result['mode']:<14}{result['lines_per_sec']:>12,}"
+          f"{result['mb_per_sec']:>9.1f}{result['peak_rss_mb']:>9.1f}{change:>9}  {phases}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput benchmark for log_processing_engine.py.")
+    parser.add_argument("--sizes", default=SIZES, help=f"comma-separated line counts (default: {SIZES})")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated modes (default: all)")
+    parser.add_argument("--seed", type=int, default=SEED, help=f"generator seed (default: {SEED})")
+    parser.add_argument("--corrupt-rate", type=float, default=CORRUPT_RATE,
+                        help=f"fraction of corrupted lines (default: {CORRUPT_RATE})")
+    parser.add_argument("--profile", choices=list(generate_log.PROFILES), default=PROFILE,
+                        help=f"workload profile of the inputs (default: {PROFILE})")
+    parser.add_argument("--data-dir", default=DATA_DIR, help=f"where inputs are kept (default: {DATA_DIR})")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per mode, fastest kept")
+    parser.add_argument("--output", default=RESULTS_FILE, help=f"results JSON (default: {RESULTS_FILE})")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"baseline JSON (default: {BASELINE_FILE})")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help=f"allowed lines/sec drop against the baseline (default: {TOLERANCE})")
+    parser.add_argument("--run-mode", nargs=2, metavar=("MODE", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_mode:
+        run_mode(*args.run_mode)
+        return 0
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)} (choose from {', '.join(MODES)})")
+    if "numpy" in modes and engine.np is None:
+        print("Skipping numpy: NumPy is not installed")
+        modes.remove("numpy")
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if (baseline.get("profile", PROFILE), baseline["seed"], baseline["corrupt_rate"]) != \
+                (args.profile, args.seed, args.corrupt_rate):
+            print(f"Not comparing with {args.baseline}: it was measured on different inputs")
+            baseline = None
+    previous = baseline and {(entry["lines"], entry["mode"]): entry["lines_per_sec"] for entry in baseline["results"]}
+
+    results = []
+    failed = []
+    generation = {}
+    print(f"{'lines':>6}  {'mode':<14}{'lines/sec':>12}{'MB/sec':>9}{'RSS MB':>9}{'vs base':>9}  phases")
+    for lines in map(parse_size, args.sizes.split(",")):
+        filename, seconds = input_file(lines, args.seed, args.corrupt_rate, args.data_dir, args.profile)
+        if seconds is not None:
+            generation[format_size(lines)] = round(seconds, 3)
+            print(f"{format_size(lines):>6}  generated {filename} in {seconds:.2f}s")
+
+        for mode in modes:
+            runs = [measure(mode, filename, lines) for _ in range(max(args.repeat, 1))]
+            if None in runs:
+                failed.append(f"{format_size(lines)} {mode}")
+                continue
+            result = min(runs, key=lambda run: run["seconds"])
+            results.append(result)
+            print_result(result, previous)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "corrupt_rate": args.corrupt_rate,
+        "profile": args.profile,
+        "generation_seconds": generation,
+        "results": results,
+    }
+    with open(args.baseline if args.save_baseline else args.output, "w") as file:
+        json.dump(report, file, indent=2)
+        file.write("\n")
+
+    if failed:
+        print(f"FAILED: {', '.join(failed)} (see stderr above)")
+    if args.save_baseline:
+        print(f"Saved baseline to {args.baseline}")
+        return 1 if failed else 0
+    print(f"Saved results to {args.output}")
+    if baseline is None:
+        return 1 if failed else 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for result, base in regressions:
+        print(f"REGRESSION {format_size(result['lines'])} {result['mode']}: "
+              f"{result['lines_per_sec']:,} lines/sec vs {base:,} in the baseline")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
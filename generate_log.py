@@ -1,30 +1,277 @@
+import argparse
+import gzip
+import os
 import random
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+from multiprocessing import Pool
+
+try:
+    import zstandard
+except ImportError:   # only needed for zstd-compressed parts
+    zstandard = None
 
 ACTIONS = ["LOGIN", "LOGOUT", "UPLOAD", "DOWNLOAD", "DELETE"]
 STATUS = ["SUCCESS", "FAIL"]
+USERS = 5000
+CORRUPT_LINE = "corrupted line without proper format\n"
+START_TIME = datetime(2026, 1, 8, 12, 0, 0)
+BATCH_SIZE = 1 << 16   # lines per generate_file_bulk batch; changing it changes the output for a seed
+COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Prebuilt pieces of a bulk-generated line: "<date> <clock> | USER_ID=.. | ACTION=.. | STATUS=..\n"
+USER_PARTS = [f" | USER_ID={user_id}" for user_id in range(1, USERS + 1)]
+TAIL_PARTS = [f" | ACTION={action} | STATUS={status}\n" for action in ACTIONS for status in STATUS]
+CLOCK = [f"{h:02}:{m:02}:{s:02}" for h in range(24) for m in range(60) for s in range(60)]
+
+# Workload profiles for the bulk generator. Every profile overrides some of the defaults:
+#   users           distinct USER_IDs (1..users)
+#   zipf            user popularity exponent: user k is drawn with weight 1 / k**zipf (0 = uniform)
+#   arrivals        "fixed": `rate` lines per second, evenly spaced; "poisson": exponential gaps;
+#                   "bursty": exponential gaps whose rate jumps `burst_factor`-fold for bursts
+#                   of about `burst_length` lines
+#   action_weights  relative weight of each of ACTIONS (None = uniform)
+#   fail_rate       long-run fraction of FAIL statuses
+#   fail_streak     mean length of a run of FAILs (1 = independent statuses)
+PROFILE_DEFAULTS = {
+    "users": USERS, "zipf": 0.0, "arrivals": "fixed", "rate": 1.0, "burst_factor": 20.0, "burst_length": 500,
+    "action_weights": None, "fail_rate": 0.5, "fail_streak": 1.0,
+}
+PROFILES = {
+    "uniform": {},   # what generate_file_bulk writes without a profile
+    "zipf": {"users": 1_000_000, "zipf": 1.1},
+    "bursty": {"arrivals": "bursty", "rate": 50.0},
+    "fail-streaks": {"fail_rate": 0.2, "fail_streak": 25.0},
+    "production": {"users": 1_000_000, "zipf": 1.1, "arrivals": "bursty", "rate": 50.0,
+                   "action_weights": [30, 25, 10, 30, 5], "fail_rate": 0.1, "fail_streak": 25.0},
+}
 
 def generate_log_line(ts):
-    user_id = random.randint(1, 5000)
+    user_id = random.randint(1, USERS)
     action = random.choice(ACTIONS)
     status = random.choice(STATUS)
 
     return f"{ts} | USER_ID={user_id} | ACTION={action} | STATUS={status}"
 
-def generate_file(filename="logs.txt", n=100000):
-    start_time = datetime(2026, 1, 8, 12, 0, 0)
+def generate_file(filename="logs.txt", n=100000, seed=None, corrupt_rate=0.05):
+    # A given seed always produces the same file
+    if seed is not None:
+        random.seed(seed)
+    start_time = START_TIME
 
     with open(filename, "w") as f:
         for i in range(n):
             ts = start_time + timedelta(seconds=i)
 
-            # Inject some corrupted lines (5%)
-            if random.random() < 0.05:
-                f.write("corrupted line without proper format\n")
+            # Inject some corrupted lines (5% by default)
+            if random.random() < corrupt_rate:
+                f.write(CORRUPT_LINE)
             else:
                 f.write(generate_log_line(ts) + "\n")
 
     print(f"Generated {n} lines in {filename}")
 
+def generate_batch(seed, batch, n, corrupt_rate=0.05):
+    # Lines [batch * BATCH_SIZE, min((batch + 1) * BATCH_SIZE, n)) of the bulk file for `seed`.
+    # Each batch draws from its own random.Random(seed, batch), so it does not depend on the
+    # batches before it: a shorter file is a prefix of a longer one.
+    first = batch * BATCH_SIZE
+    count = min(BATCH_SIZE, n - first)
+    # Always a full batch of draws, so a cut-short last batch matches the start of a full one
+    rng = random.Random(f"{seed}/{batch}")
+    user_parts = rng.choices(USER_PARTS, k=BATCH_SIZE)
+    tail_parts = rng.choices(TAIL_PARTS, k=BATCH_SIZE)
+    random_values = [rng.random() for _ in range(BATCH_SIZE)]
+
+    stamps = []
+    second = START_TIME.hour * 3600 + START_TIME.minute * 60 + START_TIME.second + first
+    while len(stamps) < count:
+        day, second_of_day = divmod(second, 86400)
+        prefix = (START_TIME.date() + timedelta(days=day)).strftime("%Y-%m-%d ")
+        piece = CLOCK[second_of_day:second_of_day + count - len(stamps)]
+        stamps += map(prefix.__add__, piece)
+        second += len(piece)
+
+    return "".join([CORRUPT_LINE if value < corrupt_rate else stamp + user + tail
+                    for stamp, user, tail, value in zip(stamps, user_parts, tail_parts, random_values)])
+
+def resolve_profile(profile=None, **overrides):
+    # Profile name or dict (plus keyword overrides) -> full parameter dict,
+    # or None when it comes down to the defaults
+    params = dict(PROFILE_DEFAULTS)
+    params.update(PROFILES[profile] if isinstance(profile, str) else profile or {})
+    params.update((key, value) for key, value in overrides.items() if value is not None)
+    unknown = set(params) - set(PROFILE_DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown profile settings: {', '.join(sorted(unknown))}")
+    if params["arrivals"] not in ("fixed", "poisson", "bursty"):
+        raise ValueError(f"unknown arrival process {params['arrivals']!r}")
+    return None if params == PROFILE_DEFAULTS else params
+
+@lru_cache(maxsize=4)
+def zipf_cum_weights(users, exponent):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, users + 1)))
+
+def arrival_offsets(rng, params, count):
+    # Second offsets (floats, non-decreasing) of `count` arrivals within a batch lasting
+    # count / rate seconds. Random gaps are scaled to fill the batch exactly, so every
+    # batch starts at a fixed time and batches stay independent of each other.
+    rate = params["rate"]
+    if params["arrivals"] == "fixed":
+        return [i / rate for i in range(count)]
+
+    if params["arrivals"] == "poisson":
+        gaps = [rng.expovariate(1.0) for _ in range(count)]
+    else:
+        # Two-state process: calm gaps with mean 1, burst gaps `burst_factor` times shorter
+        burst_factor = params["burst_factor"]
+        switch = 1 / params["burst_length"]
+        bursting = False
+        gaps = []
+        for value in (rng.random() for _ in range(count)):
+            if value < switch:
+                bursting = not bursting
+            gap = rng.expovariate(1.0)
+            gaps.append(gap / burst_factor if bursting else gap)
+
+    scale = count / rate / sum(gaps)
+    return [offset * scale for offset in accumulate(gaps)]
+
+def fail_flags(rng, params, count):
+    # Two-state Markov chain: a FAIL streak ends with probability 1 / fail_streak per line,
+    # and starts at the rate that keeps the long-run share of FAILs at fail_rate
+    fail_rate = params["fail_rate"]
+    leave = 1 / max(params["fail_streak"], 1.0)
+    enter = min(leave * fail_rate / (1 - fail_rate), 1.0) if fail_rate < 1 else 1.0
+    failed = rng.random() < fail_rate
+    flags = []
+    for value in (rng.random() for _ in range(count)):
+        failed = value >= leave if failed else value < enter
+        flags.append(failed)
+    return flags
+
+def generate_profile_batch(seed, batch, n, corrupt_rate, params):
+    # generate_batch for a workload profile; same batching, seeding and prefix property
+    first = batch * BATCH_SIZE
+    count = min(BATCH_SIZE, n - first)
+    rng = random.Random(f"{seed}/{batch}")
+
+    users = params["users"]
+    if params["zipf"]:
+        user_ids = rng.choices(range(1, users + 1), cum_weights=zipf_cum_weights(users, params["zipf"]), k=BATCH_SIZE)
+    else:
+        user_ids = rng.choices(range(1, users + 1), k=BATCH_SIZE)
+    if params["action_weights"]:
+        actions = rng.choices(range(len(ACTIONS)), weights=params["action_weights"], k=BATCH_SIZE)
+    else:
+        actions = rng.choices(range(len(ACTIONS)), k=BATCH_SIZE)
+    failed = fail_flags(rng, params, BATCH_SIZE)
+    offsets = arrival_offsets(rng, params, BATCH_SIZE)
+    random_values = [rng.random() for _ in range(BATCH_SIZE)]
+
+    start = START_TIME.hour * 3600 + START_TIME.minute * 60 + START_TIME.second
+    base = batch * BATCH_SIZE / params["rate"]
+    prefixes = {}
+    lines = []
+    for i in range(count):
+        if random_values[i] < corrupt_rate:
+            lines.append(CORRUPT_LINE)
+            continue
+        day, second_of_day = divmod(start + int(base + offsets[i]), 86400)
+        prefix = prefixes.get(day)
+        if prefix is None:
+            prefix = prefixes[day] = (START_TIME.date() + timedelta(days=day)).strftime("%Y-%m-%d ")
+        lines.append(f"{prefix}{CLOCK[second_of_day]} | USER_ID={user_ids[i]}{TAIL_PARTS[2 * actions[i] + failed[i]]}")
+    return "".join(lines)
+
+def generate_file_bulk(filename="logs.txt", n=100000, seed=None, corrupt_rate=0.05, profile=None):
+    # Same line format and distributions as generate_file, several times faster: users,
+    # action/status pairs and corruption flags are drawn a batch at a time with
+    # choices(k=...), lines are joined from prebuilt pieces and every batch goes out in one
+    # write. A given seed always produces the same file (but not the one generate_file does).
+    # `profile` is a PROFILES name or a dict of PROFILE_DEFAULTS settings.
+    if seed is None:
+        seed = random.getrandbits(64)
+    params = resolve_profile(profile)
+
+    with open(filename, "w", buffering=1 << 20) as f:
+        for batch in range((n + BATCH_SIZE - 1) // BATCH_SIZE):
+            if params is None:
+                f.write(generate_batch(seed, batch, n, corrupt_rate))
+            else:
+                f.write(generate_profile_batch(seed, batch, n, corrupt_rate, params))
+
+    print(f"Generated {n} lines in {filename}")
+
+def open_output(path, compression=None):
+    # Text file for writing, gzip- or zstd-compressed if asked
+    if compression == "gzip":
+        return gzip.open(path, "wt", compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd output needs the zstandard package installed")
+        return zstandard.open(path, "wt", cctx=zstandard.ZstdCompressor(level=3))
+    return open(path, "w", buffering=1 << 20)
+
+def partition_path(filename, index, compression=None):
+    # logs.txt -> logs.part003.txt(.gz)
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.part{index:03}{ext}{COMPRESSION_SUFFIX[compression]}"
+
+def write_partition(path, seed, first_batch, last_batch, n, corrupt_rate, compression, params=None):
+    with open_output(path, compression) as f:
+        for batch in range(first_batch, last_batch):
+            if params is None:
+                f.write(generate_batch(seed, batch, n, corrupt_rate))
+            else:
+                f.write(generate_profile_batch(seed, batch, n, corrupt_rate, params))
+    return path
+
+def generate_partitions(filename="logs.txt", n=100000, partitions=4, seed=None, corrupt_rate=0.05,
+                        compression=None, profile=None):
+    # Writes the bulk file for `seed` as `partitions` part files, one worker process each.
+    # Part i holds a contiguous run of batches, so the parts cover disjoint, consecutive
+    # timestamp ranges, and every batch has its own seed stream: the parts concatenated
+    # in order are exactly what generate_file_bulk writes. Returns the part paths.
+    if seed is None:
+        seed = random.getrandbits(64)
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError("zstd output needs the zstandard package installed")
+    params = resolve_profile(profile)
+
+    batches = (n + BATCH_SIZE - 1) // BATCH_SIZE
+    bounds = [batches * i // partitions for i in range(partitions + 1)]
+    paths = [partition_path(filename, i, compression) for i in range(partitions)] if partitions > 1 \
+        else [filename + COMPRESSION_SUFFIX[compression]]
+    jobs = [(path, seed, bounds[i], bounds[i + 1], n, corrupt_rate, compression, params)
+            for i, path in enumerate(paths)]
+
+    with Pool(min(partitions, os.cpu_count() or 1)) as pool:
+        pool.starmap(write_partition, jobs)
+
+    print(f"Generated {n} lines in {', '.join(paths) if partitions <= 2 else f'{paths[0]} .. {paths[-1]}'}")
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic `ts | USER_ID= | ACTION= | STATUS=` log.")
+    parser.add_argument("n", nargs="?", type=int, default=200000, help="number of lines (default: 200000)")
+    parser.add_argument("-o", "--output", default="logs.txt", help="output file (default: logs.txt)")
+    parser.add_argument("--seed", type=int, help="same seed, same file (default: random)")
+    parser.add_argument("--corrupt-rate", type=float, default=0.05, help="fraction of corrupted lines (default: 0.05)")
+    parser.add_argument("--partitions", type=int, default=1,
+                        help="write this many part files in parallel, one process each (default: 1)")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], help="compress the part files")
+    parser.add_argument("--profile", choices=list(PROFILES), default="uniform", help="workload profile (default: uniform)")
+    parser.add_argument("--users", type=int, help="number of distinct users (default: set by the profile)")
+    parser.add_argument("--rate", type=float, help="mean lines per second (default: set by the profile)")
+    args = parser.parse_args(argv)
+
+    profile = resolve_profile(args.profile, users=args.users, rate=args.rate)
+    if args.partitions > 1 or args.compress:
+        generate_partitions(args.output, args.n, args.partitions, args.seed, args.corrupt_rate, args.compress, profile)
+    else:
+        generate_file_bulk(args.output, args.n, args.seed, args.corrupt_rate, profile)
+
 if __name__ == "__main__":
-    generate_file(n=200000)   # change size here
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+
+import log_processing_engine as engine
+
+HOST = "127.0.0.1"
+PORT = 5140
+UNIX_SOCKET = None   # e.g. "/tmp/log_ingest.sock": listen there instead of on HOST:PORT
+READ_SIZE = 256 << 10   # bytes read from a producer at a time
+QUEUE_BLOCKS = 16   # blocks waiting to be parsed before producers stop being read (backpressure)
+QUERY = b"QUERY"   # a line "QUERY [K]" is answered with one JSON line: top K users and stats
+REPORT_INTERVAL = 0.0   # > 0 prints the top users and stats this often (seconds)
+
+
+# Producers send newline-terminated lines in the generate_log format over TCP or a Unix
+# socket, any number at once. Each connection is read in READ_SIZE chunks, cut at the last
+# newline, and the blocks of whole lines go into one bounded queue. A single consumer task
+# parses them with the mmap engine's block parser into one LogAggregator. When the queue
+# is full, connection handlers wait in put() and stop reading their sockets, so the kernel
+# buffers fill and the producers' writes block until the parser has caught up.
+#
+# A QUERY line is queued behind the lines sent before it on the same connection, so its
+# answer counts all of them.
+
+class IngestServer:
+    def __init__(self, capacity=engine.SKETCH_CAPACITY, distinct=engine.DISTINCT, failures=engine.FAILURE_RATES,
+                 queue_blocks=QUEUE_BLOCKS):
+        self.aggregator = engine.LogAggregator(capacity, distinct, failures)
+        self.tail_parser = engine.TailParser()
+        self.queue = asyncio.Queue(queue_blocks)
+        self.connections = 0
+        self.bytes_received = 0
+
+    async def consume(self):
+        # Parses queued blocks in arrival order
+        while True:
+            self.process(await self.queue.get())
+
+    def process(self, item):
+        # A block of lines, or a QUERY as (future for the answer, K)
+        if isinstance(item, bytes):
+            aggregator = self.aggregator
+            aggregator.feed_records(engine.iter_block_records(item, self.tail_parser, aggregator.rejects))
+        elif not item[0].cancelled():
+            item[0].set_result(self.summary(item[1]))
+
+    def drain(self):
+        # Parses whatever is still queued, without waiting (on shutdown)
+        while not self.queue.empty():
+            self.process(self.queue.get_nowait())
+
+    def summary(self, top_k=engine.TOP_K):
+        summary = self.aggregator.result(top_k)
+        summary["connections"] = self.connections
+        summary["bytes_received"] = self.bytes_received
+        return summary
+
+    async def query(self, top_k):
+        answer = asyncio.get_running_loop().create_future()
+        await self.queue.put((answer, top_k))
+        return await answer
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        pending = b""
+        try:
+            while True:
+                chunk = await reader.read(READ_SIZE)
+                if not chunk:
+                    break
+                self.bytes_received += len(chunk)
+                data = pending + chunk
+                cut = data.rfind(b"\n") + 1
+                pending = data[cut:]
+                if cut:
+                    await self.put_lines(data[:cut], writer)
+            if pending:
+                # The producer closed after an unterminated last line: it is complete now
+                await self.put_lines(pending + b"\n", writer)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def put_lines(self, block, writer):
+        # Queues a block of whole lines, answering the QUERY lines in it in order
+        if QUERY not in block:
+            await self.queue.put(block)
+            return
+
+        start = pos = 0   # start of the lines not queued yet, start of the current line
+        for line in block.split(b"\n")[:-1]:
+            end = pos + len(line) + 1
+            words = line.split()
+            if words[:1] == [QUERY] and len(words) <= 2:
+                if pos > start:
+                    await self.queue.put(block[start:pos])
+                start = end
+                top_k = int(words[1]) if len(words) == 2 and words[1].isdigit() else engine.TOP_K
+                writer.write(json.dumps(await self.query(top_k)).encode() + b"\n")
+                await writer.drain()
+            pos = end
+        if start < len(block):
+            await self.queue.put(block[start:])
+
+
+async def report_every(server, interval, top_k):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"\n=== {server.connections} connections | {server.bytes_received} bytes ===")
+        engine.print_report(await server.query(top_k))
+
+
+async def serve(host=HOST, port=PORT, unix_socket=UNIX_SOCKET, capacity=engine.SKETCH_CAPACITY,
+                distinct=engine.DISTINCT, failures=engine.FAILURE_RATES, report_interval=REPORT_INTERVAL,
+                top_k=engine.TOP_K):
+    # Runs until cancelled (Ctrl-C or SIGTERM), then prints the final top users and stats
+    server = IngestServer(capacity, distinct, failures)
+    if unix_socket:
+        listener = await asyncio.start_unix_server(server.handle, unix_socket)
+        where = unix_socket
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        where = f"{host}:{port}"
+    print(f"Listening on {where}", flush=True)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    tasks = [asyncio.create_task(server.consume())]
+    if report_interval > 0:
+        tasks.append(asyncio.create_task(report_every(server, report_interval, top_k)))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        if unix_socket:
+            os.remove(unix_socket)
+        server.drain()
+        print()
+        engine.print_report(server.summary(top_k))
+
+
+async def open_connection(host=HOST, port=PORT, unix_socket=UNIX_SOCKET):
+    if unix_socket:
+        return await asyncio.open_unix_connection(unix_socket)
+    return await asyncio.open_connection(host, port)
+
+
+async def send_file(filename, host=HOST, port=PORT, unix_socket=UNIX_SOCKET, top_k=engine.TOP_K):
+    # Producer side: streams a log file to the server, then asks for and returns the summary
+    reader, writer = await open_connection(host, port, unix_socket)
+    last = b"\n"
+    with open(filename, "rb") as file:
+        while chunk := file.read(READ_SIZE):
+            writer.write(chunk)
+            await writer.drain()   # blocks here while the server applies backpressure
+            last = chunk[-1:]
+    if last != b"\n":
+        writer.write(b"\n")
+    return await query(host, port, unix_socket, top_k, (reader, writer))
+
+
+async def query(host=HOST, port=PORT, unix_socket=UNIX_SOCKET, top_k=engine.TOP_K, connection=None):
+    # Current summary dict, asked for on `connection` (reader, writer) or a new one
+    reader, writer = connection or await open_connection(host, port, unix_socket)
+    writer.write(QUERY + b" %d\n" % top_k)
+    await writer.drain()
+    answer = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return answer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest `ts | USER_ID= | ACTION= | STATUS=` lines over a socket "
+                                                 "and answer top-K/stats queries.")
+    parser.add_argument("--host", default=HOST, help=f"TCP address to listen on or connect to (default: {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"TCP port (default: {PORT})")
+    parser.add_argument("--unix", default=UNIX_SOCKET, metavar="PATH", help="use a Unix socket instead of TCP")
+    parser.add_argument("-k", "--top-k", type=int, default=engine.TOP_K,
+                        help=f"number of top users (default: {engine.TOP_K})")
+    parser.add_argument("--sketch-capacity", type=int, default=engine.SKETCH_CAPACITY, metavar="N",
+                        help="approximate top-K with at most N user counters (default: exact)")
+    parser.add_argument("--distinct", choices=["exact", "approx"], default=engine.DISTINCT,
+                        help="also count distinct users per action and status")
+    parser.add_argument("--failure-rates", action="store_true", default=engine.FAILURE_RATES,
+                        help="rank users by failure rate and flag anomalous ones")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL, metavar="SECONDS",
+                        help="print the top users and stats this often (default: only on exit)")
+    parser.add_argument("--send", metavar="FILE", help="client: send FILE to the server and print the result")
+    parser.add_argument("--query", action="store_true", help="client: print the server's current result")
+    args = parser.parse_args(argv)
+    where = (args.host, args.port, args.unix)
+
+    if args.send:
+        engine.print_report(asyncio.run(send_file(args.send, *where, args.top_k)))
+    elif args.query:
+        engine.print_report(asyncio.run(query(*where, args.top_k)))
+    else:
+        try:
+            asyncio.run(serve(*where, args.sketch_capacity, args.distinct, args.failure_rates,
+                              args.report_interval, args.top_k))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
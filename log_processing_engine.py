@@ -1,48 +1,2846 @@
-from collections import defaultdict
+from array import array
+import argparse
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime
+from functools import lru_cache
+from itertools import chain, compress, groupby
+from multiprocessing import Pool
+from operator import itemgetter, methodcaller
+from queue import Empty, Queue
+import calendar
+import cProfile
+import glob
 import heapq
+import math
+import mmap
+import os
+import pstats
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:   # the columnar queries fall back to array + Counter
+    np = None
+
+try:
+    import zstandard
+except ImportError:   # only needed for zstd-compressed logs
+    zstandard = None
 
 FILE_NAME = "logs.txt"
 TOP_K = 3
+WORKERS = 1   # > 1 splits the file into newline-aligned byte ranges and scans them in a process pool
+ENGINE = "mmap"   # "text" decodes and splits every line, "mmap" reads fields off raw bytes (tallying repeats),
+                  # "numpy" parses blocks into id/code arrays and aggregates them vectorized
+DENSE_USER_LIMIT = 1 << 24   # ids below this are counted in flat arrays indexed by id (array('Q') or bincount)
+DENSE_MIN_SLOTS = 1 << 20   # exact counts of ids below this always go to an array (8 MiB at most)...
+DENSE_SLOTS_PER_USER = 8   # ...and move to a dict once it would need more slots than this per user seen
+BLOCK_SIZE = 8 << 20   # bytes of the mapped file handled per block by the mmap engine
+TAIL_CACHE_SIZE = 1 << 18   # distinct line tails kept parsed by the mmap engine
+TALLY_MAX_DISTINCT = 0.5   # the mmap engine tallies a block's line tails while at most this share of them differ...
+TALLY_RETRY_BLOCKS = 16   # ...else reads each line's fields for this many blocks before tallying one again
+QUARANTINE_FILE = None   # e.g. "rejects.txt": write sample broken lines there, with the reason
+QUARANTINE_SAMPLES = 20   # example lines kept per reject reason
+SKETCH_CAPACITY = 0   # > 0 keeps at most this many user counters (Space-Saving) instead of one per USER_ID
+DISTINCT = None   # "exact" (sets) or "approx" (HyperLogLog): also count distinct users per action and status
+HLL_PRECISION = 14   # HyperLogLog registers = 2**precision; standard error about 1.04 / sqrt(registers)
+FAILURE_RATES = False   # also keep SUCCESS/FAIL counts per user: failure-rate ranking and anomaly flags
+MIN_SUPPORT = 20   # events a user needs before being ranked by failure rate or flagged
+ANOMALY_Z = 3.0   # flag users whose failures are this many standard deviations above the overall rate
+FOLLOW = False   # keep reading what gets appended to FILE_NAME, across rotation, like `tail -F`
+REFRESH_INTERVAL = 5.0   # seconds between follow-mode reports
+POLL_INTERVAL = 0.5   # seconds to sleep at end of file in follow mode
+CHECKPOINT_FILE = None   # e.g. "logs.txt.ckpt": save the aggregation state there and resume from it on restart
+CHECKPOINT_EVERY = 256 << 20   # bytes scanned between checkpoints
 
-user_count = defaultdict(int)
-actions = set()
-total_events = 0
-failed_events = 0
+WINDOW = None   # "minute", "hour" or "day": report events, failures and top users per window instead
+SLIDING_MINUTES = 15   # window mode also tracks failures over the last N minutes (0 = off)
+TIME_RANGE = None   # e.g. ("2026-01-08 14:00:00", "2026-01-08 14:05:00"): report only [start, end)
+INDEX_STEP = 4096   # bytes per entry of the sparse timestamp index (FILE_NAME + ".idx")
+DECOMPRESS_CHUNK = 1 << 20   # compressed bytes read at a time from a .gz/.zst log
+DECOMPRESS_QUEUE = 4   # decompressed chunks the reader thread may get ahead of the parser
+COLUMNAR_FILE = None   # e.g. "logs.col": convert FILE_NAME to columns once, then answer queries from them
+ROW_GROUP_SIZE = 1 << 20   # rows per row group in the columnar file
+GROUP_BY = None   # e.g. "action,status" or "user_id,hour": count events per group instead of the report
+WHERE = None   # e.g. "status=FAIL AND action=DELETE": only lines matching all conditions (also without GROUP_BY)
+AGGREGATES = "count"   # per group: count, distinct:FIELD (distinct values) and/or top:FIELD (top-K values)
+QUERY_LIMIT = 0   # groups printed, largest count first (0 = all)
+WATCHLIST = None   # e.g. "watch.txt" (one USER_ID per line): print the lines of watched users instead
+BLOOM_FP_RATE = 0.001   # false positive rate of the Bloom filter used for ids too large for a bitmap
+SESSIONS = False   # pair LOGIN/LOGOUT per user into sessions and report on them instead
+SESSION_TIMEOUT = 30   # minutes without activity after which an open session is closed
+SESSION_BUCKET = "hour"   # "minute", "hour" or "day": concurrent sessions are reported per bucket
+PHASE_STATS = False   # time reading, parsing and counting separately and report them with per-line costs
+PROGRESS_INTERVAL = 0.0   # > 0 prints a progress line this often (seconds) during an instrumented scan
+PROFILE_FILE = None   # e.g. "engine.pstats": run under cProfile and dump the stats there
+PROFILE_TOP = 20   # functions listed from the profile, by cumulative time
 
-# Read file line by line
-with open(FILE_NAME, "r") as file:
-    for line in file:
-        try:
-            parts = line.strip().split("|")
-            if len(parts) != 4:
+# Why a line was rejected: no '|' at all (blank or junk), not 4 '|'-separated fields,
+# USER_ID without "=" or not a number int() reads, ACTION or STATUS without "="
+REJECT_REASONS = ("no_fields", "field_count", "user_id", "action", "status")
+# User ids are kept in int64 columns (NumPy engine, columnar file, checkpoint), so a valid
+# one must fit in an int64; LINE_FIELDS' 18 digits always do
+USER_ID_RANGE = range(-2 ** 63, 2 ** 63)
+
+# The options each mode takes (argparse dests), besides the file, -k and --profile. The
+# mode is the flag of its own given, checked in this order, else a plain scan; any other
+# option given a non-default value is an error rather than silently ignored
+MODE_OPTIONS = {
+    "sessions": ("session_timeout", "session_bucket", "quarantine"),
+    "watchlist": ("workers",),
+    "query": ("group_by", "where", "aggregates", "limit", "workers"),
+    "columnar": (),
+    "time_range": ("sketch_capacity", "distinct", "failure_rates", "min_support", "anomaly_z", "quarantine"),
+    "window": ("sliding_minutes", "distinct"),
+    "numpy": ("engine", "quarantine"),
+    "follow": ("interval", "checkpoint", "sketch_capacity", "failure_rates", "min_support", "anomaly_z",
+               "quarantine"),
+    "checkpoint": ("checkpoint_every", "engine", "workers", "sketch_capacity", "quarantine"),
+    "scan": ("engine", "workers", "sketch_capacity", "distinct", "failure_rates", "min_support", "anomaly_z",
+             "quarantine", "phase_stats", "progress"),
+}
+
+# magic, version, sketch flag, inode, offset, total events, failed events, users, capacity, sketch total
+CHECKPOINT_HEADER = struct.Struct("<4sBBQQQQQQQ")
+
+# Columnar file: magic, row groups, footer, trailer. A row group is a header (rows and the
+# typecodes of its user, action and status columns) followed by the timestamp (int64),
+# user, action code and status code columns. The footer holds the action and status
+# dictionaries; the trailer points at it.
+COLUMNAR_MAGIC = b"LPCOL1"
+COLUMNAR_GROUP = struct.Struct("<Q3s")
+COLUMNAR_TRAILER = struct.Struct("<QQ6s")   # footer offset, rows, magic
+NO_TIMESTAMP = -(1 << 63)   # stored for valid lines whose timestamp does not parse
+WINDOW_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# Record fields a query can filter, group or aggregate on, and the time buckets it can group
+# by, with the length of the "YYYY-MM-DD HH:MM:SS" prefix that names a bucket
+QUERY_FIELDS = ("user_id", "action", "status")
+QUERY_BUCKETS = {"minute": 16, "hour": 13, "day": 10}
+# The ":SS " between the minute and the '|' of a "YYYY-MM-DD HH:MM:SS | ..." line, all mapped to
+# ":00 ": window mode adds a minute's lines holding any of them at once (seconds move no window)
+MINUTE_SECONDS = dict.fromkeys((b":%02d " % second for second in range(60)), b":00 ")
+
+# Session duration histogram: upper bounds (seconds) and labels; the last bucket is open-ended
+SESSION_DURATIONS = (60, 300, 900, 1800, 3600, 7200)
+SESSION_DURATION_LABELS = ("< 1m", "1-5m", "5-15m", "15-30m", "30-60m", "1-2h", ">= 2h")
+SESSION_COUNT_CAP = 10   # uploads/downloads per session at or above this share the last histogram bucket
+
+PIPE = ord("|")   # `PIPE in line` tests bytes for a '|' far faster than `b"|" in line`
+
+# One match per line of a bytes block (or per line tail): USER_ID, ACTION and STATUS of a line
+# in the canonical "<timestamp> | USER_ID=<digits> | ACTION=<word> | STATUS=<word>" form, or
+# else the whole line, which check_fields decides on (so anything the original parser took counts)
+LINE_FIELDS = re.compile(rb"^(?:[^|\n]*\| USER_ID=(\d{1,18}) \| ACTION=(\w+) \| STATUS=(\w+)\r?|(.*))$", re.M)
+GZIP_MAGIC = b"\x1f\x8b\x08"   # a gzip member header (deflate)
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Files a directory or glob input skips: the side files this script writes, by the suffixes
+# it gives them (or suggests), and by how they start (index, checkpoint, columnar, watchlist
+# filter, --profile dump, a marshalled dict; quarantine "reason<TAB>line" rows)
+SIDE_FILE_SUFFIXES = (".idx", ".tmp", ".filter", ".ckpt", ".col", ".pstats", ".prof")
+SIDE_FILE_HEADS = (b"LPIDX1", b"LPCK", COLUMNAR_MAGIC, b"LPWF01", b"\xfb") + tuple(
+    reason.encode() + b"\t" for reason in REJECT_REASONS)
+
+# Timestamp index: magic, inode, log size when indexed, next block boundary to index, step,
+# entries; then the entries' timestamps (int64) and byte offsets (uint64)
+INDEX_HEADER = struct.Struct("<6sQQQQQ")
+
+# Watchlist filter: magic, kind (0 bitmap, 1 Bloom), watchlist size and mtime when built,
+# bits, hashes, ids; then the bits, and for a Bloom filter the sorted ids (int64) that
+# confirm its hits
+FILTER_HEADER = struct.Struct("<6sBQQQQQ")
+
+
+class SpaceSaving:
+    # Approximate heavy hitters in a fixed number of counters (Metwally et al., Space-Saving).
+    # When the table is full a new key takes over the smallest counter and inherits its count
+    # as error, so a reported count c with error e means the true count is in [c - e, c],
+    # and no error is larger than total / capacity.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        self.heap = []   # one (count, key) entry per key; the count may be stale (too low)
+
+    def add(self, key, count=1):
+        self.total += count
+        counts = self.counts
+
+        if key in counts:
+            counts[key] += count
+            return
+
+        if len(counts) < self.capacity:
+            counts[key] = count
+            self.errors[key] = 0
+            heapq.heappush(self.heap, (count, key))
+            return
+
+        # Find the real minimum: stale entries are pushed back with their current count
+        while True:
+            low, victim = heapq.heappop(self.heap)
+            if counts[victim] == low:
+                break
+            heapq.heappush(self.heap, (counts[victim], victim))
+
+        del counts[victim]
+        del self.errors[victim]
+        counts[key] = low + count
+        self.errors[key] = low
+        heapq.heappush(self.heap, (low + count, key))
+
+    def floor(self):
+        # Upper bound on the count of any key that is not tracked
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def max_error(self):
+        # Bound on the error of any reported count: total / capacity once the table has
+        # filled; before that only the errors merges brought in (none for a single scan)
+        if len(self.counts) < self.capacity:
+            return max(self.errors.values(), default=0)
+        return self.total // self.capacity
+
+    def merge(self, other):
+        # Mergeable summaries: a key missing from one side may have had up to that side's floor
+        floor, other_floor = self.floor(), other.floor()
+        counts = {}
+        errors = {}
+
+        for key in list(self.counts) + [key for key in other.counts if key not in self.counts]:
+            counts[key] = self.counts.get(key, floor) + other.counts.get(key, other_floor)
+            errors[key] = self.errors.get(key, floor) + other.errors.get(key, other_floor)
+
+        kept = set(heapq.nlargest(self.capacity, counts, key=counts.get))
+        self.counts = {key: c for key, c in counts.items() if key in kept}
+        self.errors = {key: errors[key] for key in self.counts}
+        self.heap = [(c, key) for key, c in self.counts.items()]
+        heapq.heapify(self.heap)
+        self.total += other.total
+
+    def top(self, k):
+        # [(key, count, error)] for the k largest counters
+        top_keys = heapq.nlargest(k, self.counts.items(), key=lambda x: x[1])
+        return [(key, count, self.errors[key]) for key, count in top_keys]
+
+
+class DenseUserCounter:
+    # Exact per-user counts for small non-negative ids: an array('Q') indexed by user_id
+    # (8 bytes a slot instead of a dict entry with two boxed ints), plus the ids in the
+    # order they first appeared, so items() and top-K ties come out exactly as from a
+    # dict filled in file order. add() returns False, counting nothing, for an id that
+    # would make the array too large or too sparse; the owner then switches to to_dict().
+
+    def __init__(self):
+        self.counts = array("Q")
+        self.order = array("I")   # ids are below DENSE_USER_LIMIT
+
+    def fits(self, user_id):
+        # Grows the array to hold user_id if that keeps it dense enough
+        if 0 <= user_id < len(self.counts):
+            return True
+        limit = min(DENSE_USER_LIMIT, max(DENSE_MIN_SLOTS, DENSE_SLOTS_PER_USER * (len(self.order) + 1)))
+        if not 0 <= user_id < limit:
+            return False
+        size = min(max(user_id + 1, 2 * len(self.counts), 1024), limit)
+        self.counts.frombytes(bytes(8 * (size - len(self.counts))))
+        return True
+
+    def add(self, user_id, count=1):
+        if not self.fits(user_id):
+            return False
+        if not self.counts[user_id]:
+            self.order.append(user_id)
+        self.counts[user_id] += count
+        return True
+
+    def keys(self):
+        return self.order
+
+    def values(self):
+        return map(self.counts.__getitem__, self.order)
+
+    def items(self):
+        return zip(self.order, self.values())
+
+    def __len__(self):
+        return len(self.order)
+
+    def to_dict(self):
+        return defaultdict(int, self.items())
+
+
+class NumpyUserCounter:
+    # Exact per-user event counts over NumPy arrays of user ids, fed in file order.
+    # Dense ids (0 <= id < DENSE_USER_LIMIT) are counted with np.bincount into a flat
+    # array; anything else switches to per-chunk np.unique results, reduced at the end.
+    # The first position of every user is kept too, so top-K ties break by first
+    # appearance, exactly like heapq.nlargest over a dict filled in file order.
+
+    def __init__(self):
+        self.total = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.first_seen = np.zeros(0, dtype=np.int64)
+        self.chunks = None   # [(unique ids, first positions, counts)] once ids are sparse
+
+    def add(self, user_ids):
+        # Columnar groups may hold ids as uint64 ("Q"); mixed with int64 NumPy would go to float64
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if len(user_ids) == 0:
+            return
+        if self.chunks is None and (user_ids.min() < 0 or user_ids.max() >= DENSE_USER_LIMIT):
+            seen = np.flatnonzero(self.counts)
+            self.chunks = [(seen, self.first_seen[seen], self.counts[seen])]
+
+        if self.chunks is not None:
+            unique, first, count = np.unique(user_ids, return_index=True, return_counts=True)
+            self.chunks.append((unique, first + self.total, count))
+            self.total += len(user_ids)
+            return
+
+        chunk_counts = np.bincount(user_ids, minlength=len(self.counts))
+        if len(chunk_counts) > len(self.counts):
+            grow = len(chunk_counts) - len(self.counts)
+            self.counts = np.concatenate([self.counts, np.zeros(grow, dtype=np.int64)])
+            self.first_seen = np.concatenate([self.first_seen, np.zeros(grow, dtype=np.int64)])
+
+        # First positions are only needed for users this chunk introduces
+        new = (chunk_counts > 0) & (self.counts == 0)
+        if new.any():
+            positions = np.flatnonzero(new[user_ids])
+            unique, first = np.unique(user_ids[positions], return_index=True)
+            self.first_seen[unique] = positions[first] + self.total
+
+        self.counts += chunk_counts
+        self.total += len(user_ids)
+
+    def users(self):
+        # (user ids, counts, first positions) of every user seen
+        if self.chunks is None:
+            seen = np.flatnonzero(self.counts)
+            return seen, self.counts[seen], self.first_seen[seen]
+
+        users, inverse = np.unique(np.concatenate([chunk[0] for chunk in self.chunks]), return_inverse=True)
+        counts = np.zeros(len(users), dtype=np.int64)
+        np.add.at(counts, inverse, np.concatenate([chunk[2] for chunk in self.chunks]))
+        first_seen = np.full(len(users), self.total, dtype=np.int64)
+        np.minimum.at(first_seen, inverse, np.concatenate([chunk[1] for chunk in self.chunks]))
+        self.chunks = [(users, first_seen, counts)]
+        return users, counts, first_seen
+
+    def __len__(self):
+        return len(self.users()[0])
+
+    def top(self, k):
+        # [(user_id, count)] for the k largest counts
+        users, counts, first_seen = self.users()
+        k = min(k, len(users))
+        if k == 0:
+            return []
+
+        # Only users at or above the k-th largest count can make it into the top k
+        kth = counts[np.argpartition(counts, len(counts) - k)[len(counts) - k:]].min()
+        candidates = np.flatnonzero(counts >= kth)
+        order = candidates[np.lexsort((first_seen[candidates], -counts[candidates]))][:k]
+        return [(int(users[i]), int(counts[i])) for i in order]
+
+
+def mix64(value):
+    # splitmix64 finalizer: spreads a user id over all 64 bits for HyperLogLog
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+class HyperLogLog:
+    # Approximate distinct counter in 2**precision one-byte registers (16 KiB at the default
+    # precision, about 0.8% standard error) whatever the number of users. Each register
+    # keeps the highest rank (leading zeros + 1) of the hashes routed to it; merging takes
+    # the register-wise maximum, so shards, files and windows combine exactly as if they
+    # had been counted together. Used like a set: add, update, |=, len.
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_hash(self, hashed):
+        index = hashed >> (64 - self.precision)
+        rank = 65 - self.precision - (hashed & ((1 << (64 - self.precision)) - 1)).bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, value):
+        self.add_hash(mix64(value))
+
+    def update(self, values):
+        for value in values:
+            self.add_hash(mix64(value))
+
+    def __ior__(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def __len__(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / math.fsum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)   # small-range correction (linear counting)
+        return round(estimate)
+
+
+def new_distinct(mode):
+    # Empty distinct-user counter for DISTINCT mode "exact" or "approx"
+    return HyperLogLog() if mode == "approx" else set()
+
+
+class WindowedStats:
+    # Events, failures and top users per fixed window (minute/hour/day), plus a ring buffer
+    # of per-minute failure counts for "failures in the last N minutes". Logs are written in
+    # time order, so a window's per-user counts are reduced to its top K as soon as a window
+    # two steps newer gets events; memory stays at about two windows of users. A late event
+    # for a closed window still counts towards its events and failures. With `distinct`,
+    # each window also reports its number of users, and the users of all windows are
+    # merged into one distinct counter (a set, or a HyperLogLog for "approx").
+    # feed_block cuts lines like GroupByQuery into a minute prefix and a tail and adds each
+    # run of lines of one minute at once, with its tails parsed through a cache and its users
+    # counted in C. Nothing but the seconds differs within such a run, so this is the
+    # line-by-line result; lines with any other head are read one by one, as iter_rows does.
+
+    def __init__(self, window="hour", top_k=TOP_K, sliding_minutes=SLIDING_MINUTES, distinct=None):
+        self.width = WINDOW_SECONDS[window]
+        self.top_k = top_k
+        self.open = {}     # window start -> [events, failed, user counts]
+        self.closed = {}   # window start -> [events, failed, top users, users]
+        self.all_users = new_distinct(distinct) if distinct else None
+
+        self.ring = [0] * sliding_minutes   # failures per minute, slot = minute % N
+        self.ring_minute = None             # newest minute held by the ring
+        self.sliding_failed = 0             # sum of the ring
+        self.peak = (0, None)               # (failures in N minutes, minute it was reached)
+        self.parsed = {}    # line tail -> record, or None if broken
+        self.minutes = {}   # minute prefix -> epoch seconds, or None if not a timestamp
+
+    def feed_block(self, block):
+        # Adds a newline-aligned block of lines, one run of lines of the same minute at a time
+        lines = block.split(b"\n")
+        if block.endswith(b"\n"):
+            lines.pop()
+        # Lines are cut where the first line's '|' is. A line whose cut falls elsewhere has no
+        # timestamp prefix or ":SS " there, so its run is read line by line anyway.
+        minute = QUERY_BUCKETS["minute"]
+        pipe = block.find(b"|")
+        width = max(pipe - block.rfind(b"\n", 0, pipe) - 1, minute)
+        seconds = list(map(itemgetter(slice(minute, width)), lines))
+        runs = groupby(zip(map(itemgetter(slice(minute)), lines), map(MINUTE_SECONDS.get, seconds, seconds),
+                           map(itemgetter(slice(width, None)), lines)), itemgetter(0, 1))
+
+        for (prefix, second), run in runs:
+            run = list(map(itemgetter(2), run))
+            if second == b":00 ":
+                timestamp = self.minutes.get(prefix, False)
+                if timestamp is False:
+                    timestamp = parse_timestamp(prefix.decode(errors="replace") + ":00")
+                    if len(self.minutes) < TAIL_CACHE_SIZE:
+                        self.minutes[prefix] = timestamp
+                if timestamp is not None and self.add_run(timestamp, run):
+                    continue
+
+            for tail in run:
+                head, pipe, tail = (prefix + second + tail).partition(b"|")
+                record = self.parsed.get(pipe + tail, False) if pipe else None
+                if record is False:
+                    record = check_fields(pipe + tail)[0]
+                    if len(self.parsed) < TAIL_CACHE_SIZE:
+                        self.parsed[pipe + tail] = record
+                if record is not None:
+                    timestamp = parse_timestamp(head.strip().decode(errors="replace"))
+                    if timestamp is not None:
+                        self.add(timestamp, [record[0]], record[2] == "FAIL")
+
+    def add_run(self, timestamp, tails):
+        # Adds the lines of one minute by their tails, if all of them start with the '|'
+        # (else returns False and adds nothing). LINE_FIELDS reads a run in the canonical
+        # form in C; other runs have each distinct tail read once and cached in `parsed`.
+        text = b"\n".join(tails)
+        if text[:1] != b"|" or text.count(b"\n|") != len(tails) - 1:
+            return False
+        rows = LINE_FIELDS.findall(text)
+        user_ids = list(map(itemgetter(0), rows))
+        if b"" not in user_ids:
+            self.add(timestamp, list(map(int, user_ids)), list(map(itemgetter(2), rows)).count(b"FAIL"))
+            return True
+
+        parsed = self.parsed
+        fresh = {}
+        match = LINE_FIELDS.match
+        for tail in set(tails).difference(parsed):
+            user_id, action, status, line = match(tail).groups()
+            if user_id:
+                fresh[tail] = (int(user_id), action.decode(), status.decode())
+            else:
+                fresh[tail] = check_fields(tail)[0]
+        if len(parsed) < TAIL_CACHE_SIZE:
+            parsed.update(fresh)
+        records = list(filter(None, map(fresh.get, tails, map(parsed.get, tails))))
+        if records:
+            self.add(timestamp, list(map(itemgetter(0), records)), list(map(itemgetter(2), records)).count("FAIL"))
+        return True
+
+    def add(self, timestamp, user_ids, failed):
+        # Adds the events of `user_ids` (`failed` of them failures), all in the minute of `timestamp`
+        start = timestamp - timestamp % self.width
+        bucket = self.open.get(start)
+
+        if bucket is None and start in self.closed:
+            bucket = self.closed[start]
+        else:
+            if bucket is None:
+                bucket = self.open[start] = [0, 0, Counter()]
+                for old in [old for old in self.open if old < start - self.width]:
+                    self.close(old)
+            bucket[2].update(user_ids)
+        bucket[0] += len(user_ids)
+        bucket[1] += failed
+
+        if self.ring:
+            self.slide(timestamp // 60, failed)
+
+    def slide(self, minute, failed):
+        size = len(self.ring)
+        if self.ring_minute is None or minute - self.ring_minute >= size:
+            self.ring = [0] * size
+            self.sliding_failed = 0
+            self.ring_minute = minute
+        elif minute > self.ring_minute:
+            # Expire only the minutes the ring moves past
+            for expired in range(self.ring_minute + 1, minute + 1):
+                self.sliding_failed -= self.ring[expired % size]
+                self.ring[expired % size] = 0
+            self.ring_minute = minute
+
+        if failed and minute > self.ring_minute - size:
+            self.ring[minute % size] += failed
+            self.sliding_failed += failed
+            if self.sliding_failed > self.peak[0]:
+                self.peak = (self.sliding_failed, self.ring_minute)
+
+    def close(self, start):
+        events, failed, user_count = self.open.pop(start)
+        top_users = heapq.nlargest(self.top_k, user_count.items(), key=lambda x: x[1])
+        self.closed[start] = [events, failed, top_users, len(user_count)]
+        if self.all_users is not None:
+            self.all_users.update(user_count)
+
+    def windows(self):
+        # [(window start, events, failed, top users, users)] in time order
+        for start in list(self.open):
+            self.close(start)
+        return [(start,) + tuple(self.closed[start]) for start in sorted(self.closed)]
+
+
+class RejectCounter:
+    # Broken-line accounting: a count per reason (REJECT_REASONS) and the first
+    # QUARANTINE_SAMPLES lines seen for each reason
+
+    def __init__(self):
+        self.counts = dict.fromkeys(REJECT_REASONS, 0)
+        self.samples = {}
+
+    def wants_sample(self, reason):
+        return len(self.samples.get(reason, ())) < QUARANTINE_SAMPLES
+
+    def add(self, reason, count=1, line=None):
+        self.counts[reason] += count
+        if line is not None and self.wants_sample(reason):
+            self.samples.setdefault(reason, []).append(line)
+
+    def merge(self, other):
+        # Adds `other` (a later part of the log); samples stay the earliest ones
+        for reason, count in other.counts.items():
+            self.counts[reason] += count
+        for reason, lines in other.samples.items():
+            samples = self.samples.setdefault(reason, [])
+            samples.extend(lines[:QUARANTINE_SAMPLES - len(samples)])
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+class FailureStats:
+    # SUCCESS/FAIL counts per user in two array('Q') columns indexed by user_id, grown on
+    # the same terms as DenseUserCounter (ids that would make them too large or too sparse
+    # go to a small overflow dict instead).
+    # Users are ranked by failure rate among those with at least MIN_SUPPORT events, and
+    # flagged when their failures exceed the overall failure rate p by ANOMALY_Z binomial
+    # standard deviations: z = (fails - n*p) / sqrt(n*p*(1-p)). Everything comes from the
+    # running counters, so shards merge exactly and follow mode re-evaluates on each report.
+
+    def __init__(self):
+        self.success = array("Q")
+        self.fail = array("Q")
+        self.dense_users = 0   # users counted in the columns
+        self.overflow = {}   # user_id -> [success, fail]
+
+    def grow(self, size):
+        # Extends the columns to `size` slots and moves the overflow ids now below it in
+        zeros = array("Q", bytes(8 * (size - len(self.success))))
+        self.success.extend(zeros)
+        self.fail.extend(zeros)
+        for user_id in [user_id for user_id in self.overflow if 0 <= user_id < size]:
+            self.success[user_id], self.fail[user_id] = self.overflow.pop(user_id)
+            self.dense_users += 1
+
+    def add(self, user_id, success, fail):
+        # Adds counts to a user known to fit in the columns
+        if not (self.success[user_id] or self.fail[user_id]) and (success or fail):
+            self.dense_users += 1
+        self.success[user_id] += success
+        self.fail[user_id] += fail
+
+    def fits(self, user_id):
+        # Grows the columns to hold user_id if that keeps them dense enough for all the users
+        # seen. Past DENSE_MIN_SLOTS they grow by half at least, so grow() goes through the
+        # overflow ids a logarithmic number of times
+        users = self.dense_users + len(self.overflow) + 1
+        if 2 * DENSE_SLOTS_PER_USER * users < 3 * len(self.success) >= 3 * DENSE_MIN_SLOTS:
+            return False   # too few users for any growth yet
+        limit = min(DENSE_USER_LIMIT, max(DENSE_MIN_SLOTS, DENSE_SLOTS_PER_USER * users))
+        size = min(max(user_id + 1, 2 * len(self.success), 1024), limit)
+        if not 0 <= user_id < size or 2 * size < 3 * len(self.success) and size > DENSE_MIN_SLOTS:
+            return False
+        self.grow(size)
+        return True
+
+    def track(self, records):
+        # Passes the records on, counting each one's status under its user
+        success = self.success
+        fail = self.fail
+        overflow = self.overflow
+        size = len(success)
+        for record in records:
+            user_id = record[0]
+            if not 0 <= user_id < size:
+                counts = overflow.get(user_id)
+                if counts is not None or not self.fits(user_id):
+                    if counts is None:
+                        counts = overflow[user_id] = [0, 0]
+                    counts[record[2] == "FAIL"] += record[3]
+                    yield record
+                    continue
+                size = len(success)
+            if not (success[user_id] or fail[user_id]):
+                self.dense_users += 1
+            if record[2] == "FAIL":
+                fail[user_id] += record[3]
+            else:
+                success[user_id] += record[3]
+            yield record
+
+    def merge(self, other):
+        if len(other.success) > len(self.success):
+            self.grow(len(other.success))
+        for mine, theirs in ((self.success, other.success), (self.fail, other.fail)):
+            mine[:len(theirs)] = array("Q", map(int.__add__, mine[:len(theirs)], theirs))
+        self.dense_users = len(self.success) - list(map(int.__or__, self.success, self.fail)).count(0)
+        for user_id, (success, fail) in other.overflow.items():
+            if 0 <= user_id < len(self.success):
+                self.add(user_id, success, fail)
                 continue
+            counts = self.overflow.setdefault(user_id, [0, 0])
+            counts[0] += success
+            counts[1] += fail
+
+    def users(self, min_support=MIN_SUPPORT):
+        # (user_id, fails, events) for every user with at least min_support events;
+        # compress() skips the empty slots of the columns in C
+        for user_id, success, fail in compress(zip(range(len(self.success)), self.success, self.fail),
+                                               map(int.__or__, self.success, self.fail)):
+            if success + fail >= min_support:
+                yield user_id, fail, success + fail
+        for user_id, (success, fail) in self.overflow.items():
+            if success + fail >= min_support:
+                yield user_id, fail, success + fail
+
+    def result(self, top_k=TOP_K, min_support=MIN_SUPPORT, threshold=ANOMALY_Z):
+        # {"min_support", "threshold", "top_rates": [(user, fails, events, rate)],
+        #  "flagged": number of anomalous users, "anomalies": [(user, fails, events, rate, z)]}
+        # Rates rank ties by more failures, then lower id; anomalies rank by z.
+        supported = list(self.users(min_support))
+        top_rates = heapq.nsmallest(top_k, supported, key=lambda x: (-x[1] / x[2], -x[1], x[0]))
+
+        total = sum(self.success) + sum(self.fail) + sum(map(sum, self.overflow.values()))
+        failed = sum(self.fail) + sum(counts[1] for counts in self.overflow.values())
+        p = failed / total if total else 0.0
+        anomalies = []
+        if 0.0 < p < 1.0:
+            for user_id, fail, events in supported:
+                z = (fail - events * p) / math.sqrt(events * p * (1 - p))
+                if z >= threshold:
+                    anomalies.append((user_id, fail, events, fail / events, z))
+        return {
+            "min_support": min_support,
+            "threshold": threshold,
+            "top_rates": [(user_id, fail, events, fail / events) for user_id, fail, events in top_rates],
+            "flagged": len(anomalies),
+            "anomalies": heapq.nsmallest(top_k, anomalies, key=lambda x: (-x[4], x[0])),
+        }
+
 
-            user_id = int(parts[1].split("=")[1])
-            action = parts[2].split("=")[1]
-            status = parts[3].split("=")[1]
+def write_quarantine(path, rejects):
+    # One "reason<TAB>line" row per sampled broken line
+    with open(path, "w") as file:
+        for reason in REJECT_REASONS:
+            for line in rejects.samples.get(reason, ()):
+                file.write(f"{reason}\t{line}\n")
 
-            # Update stats
-            total_events += 1
-            user_count[user_id] += 1
+
+class LogAggregator:
+    # Mergeable top-K/stats state: per-user event counts (exact, or a Space-Saving sketch
+    # when capacity > 0), the set of actions and the event/failure counters. Exact counts
+    # start in a DenseUserCounter and move to a dict for sparse or very large ids.
+    # Shards of one file merged in file order give exactly the serial result.
+    # With `distinct` ("exact" or "approx"), it also keeps the users seen per action and
+    # per status (sets or HyperLogLogs), and in approx mode all users in a HyperLogLog,
+    # which gives a user total even when the sketch cannot. With `failures`, it keeps
+    # per-user SUCCESS/FAIL counts in a FailureStats.
+
+    def __init__(self, capacity=0, distinct=None, failures=False):
+        self.user_count = SpaceSaving(capacity) if capacity else DenseUserCounter()
+        self.actions = set()
+        self.total_events = 0
+        self.failed_events = 0
+        self.rejects = RejectCounter()
+        self.distinct = distinct
+        self.action_users = {}
+        self.status_users = {}
+        self.all_users = HyperLogLog() if distinct == "approx" else None
+        self.failures = FailureStats() if failures else None
+
+    def feed(self, lines):
+        # Raw log lines, str or bytes; broken lines are counted in self.rejects
+        self.feed_records(iter_line_records(lines, self.rejects))
+
+    def feed_records(self, records):
+        # (user_id, action, status, count) records as yielded by the engines
+        if self.distinct:
+            records = self.track_distinct(records)
+        if self.failures is not None:
+            records = self.failures.track(records)
+        records = iter(records)
+        user_count = self.user_count
+        actions = self.actions
+        total_events = 0
+        failed_events = 0
+
+        if isinstance(user_count, DenseUserCounter):
+            counts = user_count.counts
+            order = user_count.order
+            size = len(counts)
+            for user_id, action, status, count in records:
+                total_events += count
+                if 0 <= user_id < size:
+                    if counts[user_id]:
+                        counts[user_id] += count
+                    else:
+                        counts[user_id] = count
+                        order.append(user_id)
+                elif user_count.add(user_id, count):
+                    size = len(counts)
+                else:
+                    # Too sparse for the array: this and the remaining records are counted in a dict
+                    user_count = self.user_count = user_count.to_dict()
+                    user_count[user_id] += count
+                    actions.add(action)
+                    if status == "FAIL":
+                        failed_events += count
+                    break
+                actions.add(action)
+
+                if status == "FAIL":
+                    failed_events += count
+
+        add_user = user_count.add if isinstance(user_count, SpaceSaving) else None
+        for user_id, action, status, count in records:
+            total_events += count
+            if add_user is None:
+                user_count[user_id] += count
+            else:
+                add_user(user_id, count)
             actions.add(action)
 
             if status == "FAIL":
-                failed_events += 1
+                failed_events += count
+
+        self.total_events += total_events
+        self.failed_events += failed_events
+
+    def track_distinct(self, records):
+        # Passes the records on, noting their users per action and status on the way
+        action_users = self.action_users
+        status_users = self.status_users
+        if self.all_users is None:
+            for record in records:
+                user_id, action, status, _ = record
+                users = action_users.get(action)
+                if users is None:
+                    users = action_users[action] = set()
+                users.add(user_id)
+                users = status_users.get(status)
+                if users is None:
+                    users = status_users[status] = set()
+                users.add(user_id)
+                yield record
+        else:
+            add_user = self.all_users.add_hash
+            for record in records:
+                hashed = mix64(record[0])
+                add_user(hashed)
+                users = action_users.get(record[1])
+                if users is None:
+                    users = action_users[record[1]] = HyperLogLog()
+                users.add_hash(hashed)
+                users = status_users.get(record[2])
+                if users is None:
+                    users = status_users[record[2]] = HyperLogLog()
+                users.add_hash(hashed)
+                yield record
+
+    def add_counts(self, items):
+        # Adds (user_id, count) pairs to the exact counts, moving them to a dict if need be
+        items = iter(items)
+        user_count = self.user_count
+        if isinstance(user_count, DenseUserCounter):
+            for user_id, count in items:
+                if not user_count.add(user_id, count):
+                    user_count = self.user_count = user_count.to_dict()
+                    user_count[user_id] += count
+                    break
+        for user_id, count in items:
+            user_count[user_id] += count
+
+    def merge(self, other):
+        # Adds `other` (the state of a later part of the log) into this one
+        if isinstance(self.user_count, SpaceSaving):
+            self.user_count.merge(other.user_count)
+        else:
+            self.add_counts(other.user_count.items())
+        self.actions |= other.actions
+        self.total_events += other.total_events
+        self.failed_events += other.failed_events
+        self.rejects.merge(other.rejects)
+        for mine, theirs in ((self.action_users, other.action_users), (self.status_users, other.status_users)):
+            for key, users in theirs.items():
+                if key in mine:
+                    mine[key] |= users
+                else:
+                    mine[key] = users
+        if self.all_users is not None and other.all_users is not None:
+            self.all_users |= other.all_users
+        if self.failures is not None and other.failures is not None:
+            self.failures.merge(other.failures)
+        return self
+
+    def result(self, top_k=TOP_K, min_support=MIN_SUPPORT, threshold=ANOMALY_Z):
+        # Summary dict for print_report. With a sketch, top users carry their error bound
+        # and the number of distinct users is unknown.
+        summary = {
+            "total_events": self.total_events,
+            "failed_events": self.failed_events,
+            "unique_actions": len(self.actions),
+            "rejects": dict(self.rejects.counts),
+        }
+        if isinstance(self.user_count, SpaceSaving):
+            summary["top_users"] = self.user_count.top(top_k)
+            summary["total_users"] = None
+            summary["tracked_users"] = len(self.user_count.counts)
+            summary["capacity"] = self.user_count.capacity
+            summary["max_error"] = self.user_count.max_error()
+            if self.all_users is not None:
+                summary["estimated_users"] = len(self.all_users)
+        else:
+            summary["top_users"] = heapq.nlargest(top_k, self.user_count.items(), key=lambda x: x[1])
+            summary["total_users"] = len(self.user_count)
+        if self.distinct:
+            summary["distinct"] = {
+                "mode": self.distinct,
+                "actions": {action: len(users) for action, users in sorted(self.action_users.items())},
+                "statuses": {status: len(users) for status, users in sorted(self.status_users.items())},
+            }
+        if self.failures is not None:
+            summary["failures"] = self.failures.result(top_k, min_support, threshold)
+        return summary
+
+
+def check_line(line):
+    # Returns ((user_id, action, status), None) for a valid line, else (None, reason).
+    # Valid is what the original parser took: 4 '|'-separated fields, each value the text
+    # between the field's first and second '=', USER_ID anything int() reads (" 7", "+7",
+    # "-7", "1_000") as long as it is in USER_ID_RANGE. Unlike the original parser, ACTION
+    # and STATUS come out stripped ("LOGIN " and "LOGIN" are one action, " FAIL" a failure),
+    # as LINE_FIELDS reads them, so every engine counts the same values. The same splits
+    # run in the same order, so a valid line costs what it did. A line without 4 fields,
+    # like the generator's corrupted ones, is turned away by the field count without
+    # raising; only a line with 4 fields and a bad value raises, and only then is the
+    # reason worked out.
+    parts = line.strip().split("|")
+    if len(parts) == 4:
+        try:
+            record = (int(parts[1].split("=")[1]), parts[2].split("=")[1].strip(),
+                      parts[3].split("=")[1].strip())
+        except (IndexError, ValueError):
+            pass
+        else:
+            if record[0] in USER_ID_RANGE:
+                return record, None
+    return None, reject_reason(parts)
+
+
+def reject_reason(parts):
+    # The REJECT_REASONS entry for a broken line split on '|': the first check it fails
+    if len(parts) != 4:
+        return "no_fields" if len(parts) == 1 else "field_count"
+    user_id = parts[1].split("=")
+    if len(user_id) < 2:
+        return "user_id"
+    try:
+        if int(user_id[1]) not in USER_ID_RANGE:
+            return "user_id"
+    except ValueError:
+        return "user_id"
+    return "action" if len(parts[2].split("=")) < 2 else "status"
+
+
+def check_fields(line):
+    # check_line for raw bytes (a line or a line tail); one without any '|', like the
+    # generator's corrupted lines, is turned away without being decoded
+    if PIPE not in line:
+        return None, "no_fields"
+    return check_line(line.decode("utf-8", "replace"))
+
+
+def parse_line(line):
+    # Returns (user_id, action, status), or None for a broken line
+    return check_line(line)[0]
+
+
+@lru_cache(maxsize=4096)
+def day_start(date_text):
+    # "YYYY-MM-DD" -> epoch seconds of its midnight (UTC), or None
+    try:
+        return calendar.timegm(datetime.strptime(date_text, "%Y-%m-%d").timetuple())
+    except ValueError:
+        return None
+
+
+def parse_timestamp(text):
+    # "YYYY-MM-DD HH:MM:SS" (as written by generate_log.py) -> epoch seconds, read as UTC.
+    # The date part is cached, so a line only pays for three small int() calls.
+    if len(text) == 19 and text[10] == " " and text[13] == ":" and text[16] == ":":
+        day = day_start(text[:10])
+        clock = text[11:13] + text[14:16] + text[17:19]
+        if day is None or not (clock.isdigit() and clock.isascii()):
+            return None
+        return day + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+
+    try:
+        return calendar.timegm(datetime.fromisoformat(text).timetuple())
+    except ValueError:
+        return None
+
+
+def iter_rows(filename, start=0, end=None, rejects=None):
+    # Yields (timestamp, user_id, action, status) for every valid line, in file order;
+    # broken lines are counted in `rejects` (a RejectCounter) if given.
+    # Only the text before the first '|' differs from line to line, so the fields behind
+    # it are checked once per distinct tail (check_fields("|" + tail) == check_line(line)).
+    parsed = {}
+    compression = compression_of(filename)
+    if compression and (start or end is not None):
+        raise ValueError(f"{filename} is compressed; byte ranges need an uncompressed log")
+
+    with open(filename, "rb") as file:
+        file.seek(start)
+        pos = start
+        if compression:
+            lines = chain.from_iterable(map(methodcaller("splitlines", True),
+                                            iter_decompressed_blocks(filename, compression)))
+        else:
+            lines = file
+
+        for line in lines:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+
+            head, pipe, tail = line.partition(b"|")
+            result = parsed.get(tail) if pipe else "no_fields"
+            if result is None:
+                record, reason = check_fields(b"|" + tail)
+                result = record or reason
+                if len(parsed) < TAIL_CACHE_SIZE:
+                    parsed[tail] = result
+            if type(result) is not tuple:
+                if rejects is not None:
+                    sample = line.decode(errors="replace").rstrip("\r\n") if rejects.wants_sample(result) else None
+                    rejects.add(result, 1, sample)
+                continue
+
+            timestamp = parse_timestamp(head.strip().decode(errors="replace"))
+            yield (NO_TIMESTAMP if timestamp is None else timestamp,) + result
+
+
+def iter_line_records(lines, rejects=None):
+    # Yields (user_id, action, status, 1) for the valid ones of some str or bytes lines;
+    # broken ones are counted in `rejects` (a RejectCounter) if given
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        record, reason = check_line(line)
+        if record is not None:
+            yield record + (1,)
+        elif rejects is not None:
+            rejects.add(reason, 1, line.rstrip("\r\n") if rejects.wants_sample(reason) else None)
+
+
+def iter_records(filename, start, end, rejects=None):
+    # Yields (user_id, action, status, 1) for every line that starts inside [start, end);
+    # broken ones are counted in `rejects` (a RejectCounter) if given
+    with open(filename, "rb") as file:
+        file.seek(start)
+        pos = start
+        for raw in file:
+            if pos >= end:
+                break
+            pos += len(raw)
+
+            if PIPE in raw:
+                line = raw.decode("utf-8", "replace")
+                record, reason = check_line(line)
+                if record is not None:
+                    yield record + (1,)
+                    continue
+            else:
+                line, reason = None, "no_fields"   # not worth decoding
+            if rejects is not None and rejects.wants_sample(reason):
+                rejects.add(reason, 1, (line or raw.decode("utf-8", "replace")).rstrip("\r\n"))
+            elif rejects is not None:
+                rejects.add(reason)
+
+
+def tail_width(block, lines):
+    # Width of the timestamp shared by the lines of `block`: that of the first line
+    # holding a '|' (a broken line may come first). If any line's cut-off prefix would
+    # hold a '|' the cut would change that line's parts, so then it is 0.
+    pipe = block.find(b"|")
+    width = pipe - block.rfind(b"\n", 0, pipe) - 1 if pipe >= 0 else 0
+    if width and b"|" in b"".join(map(itemgetter(slice(width)), lines)):
+        width = 0
+    return width
+
+
+def line_tails(block):
+    # Iterator over the lines of `block` with their common-width timestamp cut off
+    lines = block.split(b"\n")
+    return map(itemgetter(slice(tail_width(block, lines), None)), lines)
+
+
+class TailParser:
+    # What iter_block_records keeps from one block to the next of a scan: the result of
+    # every line tail read so far, and how many more blocks go line by line before a
+    # block is tallied again
+
+    def __init__(self):
+        self.parsed = {}       # line tail -> record, or reject reason
+        self.line_blocks = 0   # blocks left to read through iter_line_fields
+
+
+def iter_block_records(block, tail_parser, rejects=None):
+    # Yields (user_id, action, status, count) for a bytes block of whole lines.
+    # Lines share a fixed-width timestamp, so every line is cut at the first line's '|'
+    # and the remaining field bytes are tallied in C (split/slice/Counter), without a
+    # Python frame, decode or split list per line. Each distinct tail is then read once
+    # with LINE_FIELDS (the record or reject reason is cached in `tail_parser`, a
+    # TailParser kept for the whole scan); broken lines are counted in `rejects` (a
+    # RejectCounter) if given. Tallying only pays when tails repeat: once more than
+    # TALLY_MAX_DISTINCT of a block's tails differ (many users), the next
+    # TALLY_RETRY_BLOCKS blocks go line by line through iter_line_fields.
+    if not block:
+        return
+    if tail_parser.line_blocks:
+        tail_parser.line_blocks -= 1
+        yield from iter_line_fields(block, rejects)
+        return
+    lines = block.split(b"\n")
+    tails = Counter(map(itemgetter(slice(tail_width(block, lines), None)), lines))
+    if block.endswith(b"\n"):
+        tails[b""] -= 1   # what split() leaves after the last newline
+    if len(tails) > TALLY_MAX_DISTINCT * len(lines):
+        tail_parser.line_blocks = TALLY_RETRY_BLOCKS
+
+    parsed = tail_parser.parsed
+    names = {}
+    match = LINE_FIELDS.match
+    for tail, count in tails.items():
+        result = parsed.get(tail)
+        if result is None:
+            user_id, action, status, line = match(tail).groups()
+            if user_id:
+                result = (int(user_id), names.get(action) or names.setdefault(action, action.decode()),
+                          names.get(status) or names.setdefault(status, status.decode()))
+            else:
+                record, reason = check_fields(tail)
+                result = record or reason
+            if len(parsed) < TAIL_CACHE_SIZE:
+                parsed[tail] = result
+
+        if type(result) is tuple:
+            yield result + (count,)
+        elif rejects is not None and count:
+            rejects.add(result, count, find_line(block, tail) if rejects.wants_sample(result) else None)
 
-        except:
-            # Ignore broken lines
+
+def iter_line_fields(block, rejects=None):
+    # iter_block_records for lines that rarely repeat: LINE_FIELDS.findall reads USER_ID,
+    # ACTION and STATUS off each line's bytes in C, leaving Python one int() per line and
+    # check_fields for the lines not in the canonical form
+    rows = LINE_FIELDS.findall(block)
+    if block.endswith(b"\n"):
+        rows.pop()   # the empty match after the last newline
+    names = {}
+    for user_id, action, status, line in rows:
+        if user_id:
+            yield (int(user_id), names.get(action) or names.setdefault(action, action.decode()),
+                   names.get(status) or names.setdefault(status, status.decode()), 1)
+            continue
+        record, reason = check_fields(line)
+        if record is not None:
+            yield record + (1,)
+        elif rejects is not None:
+            rejects.add(reason, 1, line.decode(errors="replace") if line and rejects.wants_sample(reason) else None)
+
+
+def find_line(block, tail):
+    # A whole line of `block` ending in `tail` (the sample for a rejected tail), or None
+    # when the tail is empty and says nothing about which line it came from
+    if not tail:
+        return None
+    end = block.find(tail + b"\n")
+    if end < 0:
+        if not block.endswith(tail):
+            return None
+        end = len(block) - len(tail)
+    start = block.rfind(b"\n", 0, end) + 1
+    return block[start:end + len(tail)].decode(errors="replace")
+
+
+def iter_mmap_blocks(filename, start=0, end=None):
+    # Newline-aligned blocks of about BLOCK_SIZE bytes holding the lines of the mapped
+    # file that start inside [start, end)
+    with open(filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            end = len(buf) if end is None else min(end, len(buf))
+            pos = start
+
+            while pos < end:
+                block_end = buf.find(b"\n", min(pos + BLOCK_SIZE, end), end) + 1 or end
+                yield buf[pos:block_end]
+                pos = block_end
+
+
+def iter_records_mmap(filename, start, end, rejects=None):
+    # Yields (user_id, action, status, count) for the lines that start inside [start, end),
+    # handing the mapped file to iter_block_records one newline-aligned block at a time
+    tail_parser = TailParser()
+    for block in iter_mmap_blocks(filename, start, end):
+        yield from iter_block_records(block, tail_parser, rejects)
+
+
+def compression_of(filename):
+    # "gzip", "zstd" or None, from the file's magic bytes
+    with open(filename, "rb") as file:
+        magic = file.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def decompress_to_queue(filename, compression, queue, stop, start, end, state):
+    # Reader thread: puts decompressed chunks into `queue`, then None. gzip is decoded member
+    # by member from `start` (a member start), stopping at the first member end at or after
+    # `end`; the compressed offset where decoding stopped goes to state["end"]. An exception
+    # is handed over in state["error"].
+    try:
+        with open(filename, "rb") as file:
+            file.seek(start)
+            if compression == "zstd":
+                with zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True) as reader:
+                    while not stop.is_set():
+                        chunk = reader.read(DECOMPRESS_CHUNK)
+                        if not chunk:
+                            break
+                        queue.put(chunk)
+                return
+
+            pos = start
+            decompressor = zlib.decompressobj(31)
+            member_start = True
+            while not stop.is_set():
+                data = file.read(DECOMPRESS_CHUNK)
+                if not data:
+                    if not member_start:
+                        raise EOFError(f"{filename} ends in the middle of a gzip member")
+                    break
+
+                while data and not stop.is_set():
+                    chunk = decompressor.decompress(data)
+                    if chunk:
+                        queue.put(chunk)
+                    if not decompressor.eof:
+                        pos += len(data)
+                        member_start = False
+                        break
+
+                    # Member done; anything left over starts the next one
+                    pos += len(data) - len(decompressor.unused_data)
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                    member_start = True
+                    if end is not None and pos >= end:
+                        state["end"] = pos
+                        return
+            state["end"] = pos
+    except Exception as error:
+        state["error"] = error
+    finally:
+        if not stop.is_set():
+            queue.put(None)
+
+
+def iter_decompressed_blocks(filename, compression, start=0, end=None, state=None):
+    # Newline-aligned blocks of the decompressed log (the last one may lack its newline).
+    # A reader thread decompresses while the caller parses (zlib and zstd release the GIL);
+    # the bounded queue between them keeps memory at a few chunks whatever the file size.
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError(f"{filename} is zstd-compressed; that needs the zstandard package installed")
+
+    state = {} if state is None else state
+    queue = Queue(DECOMPRESS_QUEUE)
+    stop = threading.Event()
+    reader = threading.Thread(target=decompress_to_queue,
+                              args=(filename, compression, queue, stop, start, end, state), daemon=True)
+    reader.start()
+
+    try:
+        pending = b""
+        while (chunk := queue.get()) is not None:
+            cut = chunk.rfind(b"\n") + 1
+            if cut == 0:
+                pending += chunk
+                continue
+            yield pending + chunk[:cut]
+            pending = chunk[cut:]
+
+        if "error" in state:
+            raise state["error"]
+        if pending:
+            yield pending
+    finally:
+        # Unblock the reader if the caller stopped early
+        stop.set()
+        while reader.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
+
+
+def iter_file_blocks(filename):
+    # Newline-aligned blocks of about BLOCK_SIZE bytes of the whole log, compressed or not
+    compression = compression_of(filename)
+    if compression:
+        yield from iter_decompressed_blocks(filename, compression)
+    else:
+        yield from iter_mmap_blocks(filename)
+
+
+def gzip_member_starts(filename, parts):
+    # Offsets that split a multi-member gzip file (e.g. concatenated .gz parts) into up to
+    # `parts` ranges: the first member header that decodes at or after each even split
+    # point, searched up to the next split point. A match inside compressed data that
+    # happens to decode is caught later: the range before it will not stop exactly there.
+    size = os.path.getsize(filename)
+    starts = [0]
+
+    with open(filename, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for i in range(1, parts):
+            pos, limit = size * i // parts, size * (i + 1) // parts
+            while (pos := buf.find(GZIP_MAGIC, max(pos, starts[-1] + 1), limit)) >= 0:
+                if not buf[pos + 3] & 0xE0:   # reserved flag bits must be clear
+                    try:
+                        zlib.decompressobj(31).decompress(buf[pos:pos + (1 << 16)], 1 << 12)
+                        starts.append(pos)
+                        break
+                    except zlib.error:
+                        pass
+                pos += 1
+
+    return starts
+
+
+def scan_compressed_range(filename, compression, start=0, end=None, engine=ENGINE, capacity=SKETCH_CAPACITY,
+                          first=True, distinct=DISTINCT, failures=FAILURE_RATES):
+    # Aggregates the gzip members from `start` to the first member end at or after `end` (or
+    # a whole zstd/gzip file). Returns (aggregator, head, tail, stop): unless `first`, the
+    # text before the first newline is not parsed but returned as head, the text after the
+    # last newline as tail (None if the range has no newline), so that the caller
+    # can rejoin lines split between ranges; stop is where decoding ended.
+    aggregator = LogAggregator(capacity, distinct, failures)
+    tail_parser = TailParser()
+    state = {}
+    head = b"" if first else None
+    tail = None
+
+    for block in iter_decompressed_blocks(filename, compression, start, end, state):
+        if head is None:
+            cut = block.find(b"\n")
+            if cut < 0:
+                head = block
+                break
+            head, block = block[:cut], block[cut + 1:]
+
+        cut = block.rfind(b"\n") + 1
+        tail = block[cut:]
+        if engine == "mmap":
+            aggregator.feed_records(iter_block_records(block[:cut], tail_parser, aggregator.rejects))
+        else:
+            aggregator.feed(block[:cut].split(b"\n")[:-1])
+
+    if head is None:
+        head = b""   # nothing decoded at all
+    return aggregator, head, tail, state.get("end")
+
+
+def scan_compressed(filename, workers=1, engine=ENGINE, capacity=SKETCH_CAPACITY, distinct=DISTINCT,
+                    failures=FAILURE_RATES):
+    # Multi-member gzip files are split at member starts and the ranges decompressed and
+    # parsed in a process pool; the lines cut at range edges are rejoined and parsed in
+    # file order between the shard merges, so the result equals the serial one. Anything
+    # else, or a split that turns out not to be at member starts, is scanned in one pass.
+    compression = compression_of(filename)
+    results = None
+
+    if compression == "gzip" and workers > 1:
+        starts = gzip_member_starts(filename, workers)
+        if len(starts) > 1:
+            ends = starts[1:] + [os.path.getsize(filename)]
+            jobs = [(filename, compression, start, end, engine, capacity, i == 0, distinct, failures)
+                    for i, (start, end) in enumerate(zip(starts, starts[1:] + [None]))]
+            try:
+                with Pool(len(jobs)) as pool:
+                    results = pool.starmap(scan_compressed_range, jobs)
+            except (zlib.error, EOFError):
+                results = None
+            if results is not None and any(result[3] != end for result, end in zip(results, ends)):
+                results = None
+
+    if results is None:
+        results = [scan_compressed_range(filename, compression, 0, None, engine, capacity, True, distinct, failures)]
+
+    aggregator, _, carry, _ = results[0]
+    for shard, head, tail, _ in results[1:]:
+        if tail is None:
+            carry += head
             continue
+        aggregator.feed([carry + head])
+        aggregator.merge(shard)
+        carry = tail
+    if carry:
+        aggregator.feed([carry])
+    return aggregator
+
+
+def iter_numpy_chunks(filename, action_codes, status_codes, rejects=None):
+    # Yields (user_ids, action codes, status codes) NumPy arrays per block of the file, one
+    # entry per valid line in file order. Every line is mapped to its distinct tail in C
+    # (dict/map/fromiter), each distinct tail is parsed and encoded once, and the per-line
+    # columns are gathered from the per-tail table. New actions/statuses get the next code;
+    # broken lines are encoded with status -(1 + reason index), dropped and counted in
+    # `rejects` if given.
+    parsed = {}
+
+    for block in iter_file_blocks(filename):
+        tails = list(line_tails(block))
+
+        distinct = list(dict.fromkeys(tails))
+        index = dict(zip(distinct, range(len(distinct))))
+        line_codes = np.fromiter(map(index.__getitem__, tails), dtype=np.int64, count=len(tails))
+
+        encoded = list(map(parsed.get, distinct))
+        for i in [i for i, record in enumerate(encoded) if record is None]:
+            record, reason = check_fields(distinct[i])
+            if record is None:
+                encoded[i] = (0, -1, -1 - REJECT_REASONS.index(reason))
+            else:
+                encoded[i] = (record[0],
+                              action_codes.setdefault(record[1], len(action_codes)),
+                              status_codes.setdefault(record[2], len(status_codes)))
+            if len(parsed) < TAIL_CACHE_SIZE:
+                parsed[distinct[i]] = encoded[i]
+
+        table = np.fromiter(chain.from_iterable(encoded), dtype=np.int64, count=3 * len(encoded)).reshape(-1, 3)
+        if rejects is not None:
+            tail_counts = np.bincount(line_codes, minlength=len(distinct))
+            if block.endswith(b"\n"):
+                tail_counts[index[b""]] -= 1   # what split() leaves after the last newline
+            for i in np.flatnonzero((table[:, 2] < 0) & (tail_counts > 0)):
+                reason = REJECT_REASONS[-1 - int(table[i, 2])]
+                tail = distinct[i]
+                rejects.add(reason, int(tail_counts[i]), find_line(block, tail) if rejects.wants_sample(reason) else None)
+
+        rows = table[line_codes]
+        rows = rows[rows[:, 2] >= 0]
+        yield rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def scan_numpy(filename, top_k=TOP_K, rejects=None):
+    # Same summary dict as LogAggregator.result(); broken lines are counted in `rejects`
+    # (a RejectCounter) if given
+    if np is None:
+        raise RuntimeError('ENGINE = "numpy" needs NumPy installed')
+
+    action_codes = {}
+    status_codes = {"FAIL": 0}
+    user_count = NumpyUserCounter()
+    failed_events = 0
+    rejects = RejectCounter() if rejects is None else rejects
+
+    for user_ids, actions, statuses in iter_numpy_chunks(filename, action_codes, status_codes, rejects):
+        user_count.add(user_ids)
+        failed_events += int(np.count_nonzero(statuses == 0))
+
+    return {
+        "top_users": user_count.top(top_k),
+        "total_users": len(user_count),
+        "total_events": user_count.total,
+        "failed_events": failed_events,
+        "unique_actions": len(action_codes),
+        "rejects": dict(rejects.counts),
+    }
+
+
+class PhaseStats:
+    # Instrumentation for scan_instrumented: seconds spent per phase ("read": getting the
+    # next block off the mapped or decompressed file, "parse": turning it into records,
+    # "update": counting them) and running counters, plus a progress line on stderr every
+    # `progress` seconds. Nothing in the regular scans refers to it, so they pay nothing.
+
+    def __init__(self, total_bytes=0, progress=PROGRESS_INTERVAL):
+        self.seconds = dict.fromkeys(("read", "parse", "update"), 0.0)
+        self.bytes = 0
+        self.lines = 0
+        self.records = 0   # records handed to the aggregator (one per distinct line tail for mmap)
+        self.total_bytes = total_bytes
+        self.progress = progress
+        self.started = time.perf_counter()
+        self.next_progress = self.started + progress
+
+    def add_block(self, block, records, read, parse, update):
+        self.bytes += len(block)
+        self.lines += block.count(b"\n") + (not block.endswith(b"\n"))
+        self.records += records
+        self.seconds["read"] += read
+        self.seconds["parse"] += parse
+        self.seconds["update"] += update
+        if self.progress and time.perf_counter() >= self.next_progress:
+            self.print_progress()
+            self.next_progress += self.progress
+
+    def print_progress(self):
+        elapsed = time.perf_counter() - self.started
+        done = f"{self.bytes / self.total_bytes:6.1%} " if self.total_bytes else ""
+        print(f"progress: {done}{self.bytes / 1e6:,.1f} MB, {self.lines:,} lines, "
+              f"{self.lines / elapsed / 1e6:.2f} M lines/s, {elapsed:.1f}s", file=sys.stderr, flush=True)
+
+    def report(self, aggregator):
+        # Per-phase times and costs per line, on stderr so the report on stdout stays the same
+        lines = max(self.lines, 1)
+        elapsed = time.perf_counter() - self.started
+        print("\nPhases:", file=sys.stderr)
+        for phase, seconds in self.seconds.items():
+            print(f"  {phase:<7}{seconds:9.3f}s{seconds / lines * 1e9:9.0f} ns/line", file=sys.stderr)
+        print(f"  {'total':<7}{elapsed:9.3f}s{elapsed / lines * 1e9:9.0f} ns/line", file=sys.stderr)
+        print(f"Counters: {self.bytes:,} bytes read, {self.lines:,} lines, {self.records:,} records, "
+              f"{aggregator.total_events:,} events, {aggregator.rejects.total():,} rejects", file=sys.stderr)
+        print(f"Throughput: {self.lines / elapsed / 1e6:.2f} M lines/s, {self.bytes / elapsed / 1e6:.1f} MB/s",
+              file=sys.stderr)
+
+
+def scan_instrumented(filename, engine=ENGINE, capacity=SKETCH_CAPACITY, distinct=DISTINCT,
+                      failures=FAILURE_RATES, stats=None):
+    # Serial scan of a whole (plain or compressed) log one block at a time, with the phases
+    # timed into `stats` (a PhaseStats). The records of a block are parsed into a list
+    # before they are counted so that parsing and counting can be timed apart; the result
+    # is the same as scan_file's.
+    aggregator = LogAggregator(capacity, distinct, failures)
+    stats = PhaseStats(os.path.getsize(filename)) if stats is None else stats
+    tail_parser = TailParser()
+    blocks = iter_file_blocks(filename)
+    clock = time.perf_counter
+
+    while True:
+        started = clock()
+        block = next(blocks, None)
+        read = clock()
+        if block is None:
+            break
+        if engine == "mmap":
+            records = list(iter_block_records(block, tail_parser, aggregator.rejects))
+        else:
+            lines = block.split(b"\n")
+            if block.endswith(b"\n"):
+                lines.pop()
+            records = list(iter_line_records(lines, aggregator.rejects))
+        parse = clock()
+        aggregator.feed_records(records)
+        stats.add_block(block, len(records), read - started, parse - read, clock() - parse)
+
+    return aggregator
+
+
+def scan_range(filename, start, end, engine=ENGINE, capacity=SKETCH_CAPACITY, distinct=DISTINCT,
+               failures=FAILURE_RATES):
+    records = iter_records_mmap if engine == "mmap" else iter_records
+    aggregator = LogAggregator(capacity, distinct, failures)
+    aggregator.feed_records(records(filename, start, end, aggregator.rejects))
+    return aggregator
+
+
+def split_ranges(filename, parts, start=0, end=None):
+    # Cut [start, end) into `parts` byte ranges, every boundary moved forward to the next line start
+    if end is None:
+        end = os.path.getsize(filename)
+    bounds = [start]
+
+    with open(filename, "rb") as file:
+        for i in range(1, parts):
+            file.seek(start + (end - start) * i // parts)
+            file.readline()
+            bounds.append(min(max(file.tell(), bounds[-1]), end))
+
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+
+def shard_jobs(filenames, workers, task):
+    # (filename, start, end, task) shards of several logs, in file order: each plain file cut
+    # into `workers` ranges by split_ranges, each compressed one whole (start and end None)
+    jobs = []
+    for filename in filenames:
+        if compression_of(filename):
+            jobs.append((filename, None, None, task))
+        else:
+            jobs += [(filename, start, end, task) for start, end in split_ranges(filename, workers)]
+    return jobs
+
+
+def merge_results(results):
+    # Merge shard aggregators into the first one, in file order, so ties in top-K
+    # break the same way as a serial scan
+    aggregator = results[0]
+    for shard in results[1:]:
+        aggregator.merge(shard)
+    return aggregator
+
+
+def scan_file(filename, workers=1, engine=ENGINE, capacity=SKETCH_CAPACITY, start=0, end=None, distinct=DISTINCT,
+              failures=FAILURE_RATES):
+    if compression_of(filename):
+        if start or end is not None:
+            raise ValueError(f"{filename} is compressed; byte ranges need an uncompressed log")
+        return scan_compressed(filename, workers, engine, capacity, distinct, failures)
+
+    ranges = split_ranges(filename, workers, start, end)
+
+    if workers == 1:
+        return scan_range(filename, *ranges[0], engine, capacity, distinct, failures)
+
+    with Pool(workers) as pool:
+        results = pool.starmap(scan_range, [(filename, s, e, engine, capacity, distinct, failures)
+                                             for s, e in ranges])
+
+    return merge_results(results)
+
+
+def expand_inputs(pattern, written=()):
+    # A directory (its files), a glob pattern or a single path -> sorted list of log files.
+    # What this script writes is skipped: the paths this run writes (`written`), and files
+    # that have a side-file suffix or start like an index, checkpoint, columnar, filter or
+    # quarantine file.
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern) if not name.startswith(".")]
+    elif glob.has_magic(pattern):
+        paths = glob.glob(pattern)
+    else:
+        return [pattern]
+    written = {os.path.realpath(path) for path in written if path}
+    return sorted(path for path in paths
+                  if os.path.isfile(path) and not path.endswith(SIDE_FILE_SUFFIXES)
+                  and os.path.realpath(path) not in written and not is_side_file(path))
+
+
+def is_side_file(path):
+    # Whether the file starts like one this script writes (see SIDE_FILE_HEADS)
+    with open(path, "rb") as file:
+        return file.read(16).startswith(SIDE_FILE_HEADS)
+
+
+def scan_one(job):
+    # Pool task for scan_files: (filename, engine, capacity, distinct, failures) -> (aggregator, seconds)
+    filename, engine, capacity, distinct, failures = job
+    started = time.perf_counter()
+    aggregator = scan_file(filename, 1, engine, capacity, distinct=distinct, failures=failures)
+    return aggregator, time.perf_counter() - started
+
+
+def scan_files(filenames, workers=1, engine=ENGINE, capacity=SKETCH_CAPACITY, progress=True, distinct=DISTINCT,
+               failures=FAILURE_RATES):
+    # Scans each file whole in one worker, at most `workers` files at a time, and merges the
+    # per-file aggregators in the order given as they come in, so ties in top-K break as in
+    # one serial pass over the files. A single file gets the worker pool to itself instead.
+    if len(filenames) == 1:
+        return scan_file(filenames[0], workers, engine, capacity, distinct=distinct, failures=failures)
+
+    jobs = [(filename, engine, capacity, distinct, failures) for filename in filenames]
+    aggregator = LogAggregator(capacity, distinct, failures)
+    pool = Pool(min(workers, len(jobs))) if workers > 1 else None
+    try:
+        results = pool.imap(scan_one, jobs) if pool else map(scan_one, jobs)
+        for i, (filename, (shard, seconds)) in enumerate(zip(filenames, results), 1):
+            aggregator.merge(shard)
+            if progress:
+                print(f"[{i}/{len(filenames)}] {filename}: {shard.total_events} events, "
+                      f"{shard.failed_events} failed, {seconds:.2f}s", file=sys.stderr)
+    finally:
+        if pool:
+            pool.terminate()
+
+    return aggregator
+
+
+def save_checkpoint(path, inode, offset, aggregator):
+    # Layout: header, user ids (int64), counts (uint64), [errors (uint64)], reject counts
+    # (uint64, REJECT_REASONS order), newline-terminated actions, then a CRC32 of everything
+    # before it. The file is written next to the
+    # target, fsynced and renamed over it, so a crash leaves either the old or the new one.
+    user_count = aggregator.user_count
+    if isinstance(user_count, SpaceSaving):
+        counts = user_count.counts
+        sketch = (1, user_count.capacity, user_count.total)
+    else:
+        counts = user_count
+        sketch = (0, 0, 0)
+
+    parts = [
+        CHECKPOINT_HEADER.pack(b"LPCK", 2, sketch[0], inode, offset, aggregator.total_events,
+                               aggregator.failed_events, len(counts), sketch[1], sketch[2]),
+        array("q", counts.keys()).tobytes(),
+        array("Q", counts.values()).tobytes(),
+    ]
+    if sketch[0]:
+        parts.append(array("Q", user_count.errors.values()).tobytes())
+    parts.append(array("Q", [aggregator.rejects.counts[reason] for reason in REJECT_REASONS]).tobytes())
+    parts.append("".join(action + "\n" for action in aggregator.actions).encode())
+    payload = b"".join(parts)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(payload)
+        file.write(struct.pack("<I", zlib.crc32(payload)))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    # Returns (inode, offset, aggregator), or None if there is no checkpoint
+    # or it does not pass its checksum. Version 1 files (no reject counts) still load.
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+
+    payload = data[:-4]
+    if len(data) < CHECKPOINT_HEADER.size + 4 or struct.unpack("<I", data[-4:])[0] != zlib.crc32(payload):
+        return None
+
+    magic, version, is_sketch, inode, offset, total_events, failed_events, users, capacity, sketch_total = \
+        CHECKPOINT_HEADER.unpack_from(payload)
+    if magic != b"LPCK" or version not in (1, 2):
+        return None
+
+    pos = CHECKPOINT_HEADER.size
+    columns = []
+    for typecode in ("q", "Q", "Q")[:2 + is_sketch]:
+        column = array(typecode)
+        column.frombytes(payload[pos:pos + users * column.itemsize])
+        pos += users * column.itemsize
+        columns.append(column)
+
+    aggregator = LogAggregator(capacity if is_sketch else 0)
+    aggregator.total_events = total_events
+    aggregator.failed_events = failed_events
+    if version >= 2:
+        rejects = array("Q")
+        rejects.frombytes(payload[pos:pos + len(REJECT_REASONS) * rejects.itemsize])
+        pos += len(REJECT_REASONS) * rejects.itemsize
+        aggregator.rejects.counts.update(zip(REJECT_REASONS, rejects))
+    aggregator.actions = set(payload[pos:].decode().split("\n")[:-1])
+
+    if is_sketch:
+        user_count = aggregator.user_count
+        user_count.counts = dict(zip(columns[0], columns[1]))
+        user_count.errors = dict(zip(columns[0], columns[2]))
+        user_count.heap = [(count, user_id) for user_id, count in user_count.counts.items()]
+        heapq.heapify(user_count.heap)
+        user_count.total = sketch_total
+    else:
+        aggregator.add_counts(zip(columns[0], columns[1]))
+
+    return inode, offset, aggregator
+
+
+def resume_state(checkpoint, inode, size, capacity):
+    # Checkpointed state if it belongs to this file (same inode, not longer than it now)
+    # and was taken in the same counting mode, else None
+    state = load_checkpoint(checkpoint) if checkpoint else None
+    if state is None or state[0] != inode or state[1] > size:
+        return None
+
+    user_count = state[2].user_count
+    if isinstance(user_count, SpaceSaving) != bool(capacity) or (capacity and user_count.capacity != capacity):
+        return None
+    return state
+
+
+def complete_size(filename, size):
+    # Length of the file up to and including its last newline
+    with open(filename, "rb") as file:
+        pos = size
+        while pos > 0:
+            step = min(pos, 1 << 16)
+            file.seek(pos - step)
+            cut = file.read(step).rfind(b"\n")
+            if cut >= 0:
+                return pos - step + cut + 1
+            pos -= step
+    return 0
+
+
+def scan_with_checkpoints(filename, checkpoint, workers=1, engine=ENGINE, capacity=SKETCH_CAPACITY,
+                          every=CHECKPOINT_EVERY):
+    # Scans the file in newline-aligned pieces of about `every` bytes (each one split over
+    # the worker pool as usual) and checkpoints the merged state after each piece.
+    # An unterminated last line may still be being written, so it is left for the next run.
+    stat = os.stat(filename)
+    size = complete_size(filename, stat.st_size)
+    state = resume_state(checkpoint, stat.st_ino, size, capacity)
+
+    if state is None:
+        offset = 0
+        aggregator = LogAggregator(capacity)
+    else:
+        offset, aggregator = state[1:]
+        print(f"Resuming {filename} from byte {offset}")
+
+    with open(filename, "rb") as file:
+        while offset < size:
+            file.seek(min(offset + every, size))
+            file.readline()
+            end = min(file.tell(), size)
+
+            aggregator.merge(scan_file(filename, workers, engine, capacity, offset, end))
+            offset = end
+            save_checkpoint(checkpoint, stat.st_ino, offset, aggregator)
+
+    return aggregator
+
+
+def narrow_typecode(values):
+    # Smallest array typecode that holds every value (codes and ids are usually tiny)
+    low, high = min(values, default=0), max(values, default=0)
+    if low < 0:
+        return "q"
+    for typecode in "BHIQ":
+        if high < 1 << (8 * array(typecode).itemsize):
+            return typecode
+    raise OverflowError(f"value {high} does not fit in 64 bits")
+
+
+def convert_to_columnar(filename, out_path, group_size=ROW_GROUP_SIZE):
+    # One pass over the text log; rows are buffered one row group at a time,
+    # so memory stays bounded whatever the size of the log
+    action_codes = {}
+    status_codes = {}
+    rows = 0
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(COLUMNAR_MAGIC)
+        group = (array("q"), [], [], [])
+
+        for timestamp, user_id, action, status in iter_rows(filename):
+            group[0].append(timestamp)
+            group[1].append(user_id)
+            group[2].append(action_codes.setdefault(action, len(action_codes)))
+            group[3].append(status_codes.setdefault(status, len(status_codes)))
+
+            if len(group[0]) == group_size:
+                write_row_group(out, *group)
+                rows += group_size
+                group = (array("q"), [], [], [])
+
+        if group[0]:
+            write_row_group(out, *group)
+            rows += len(group[0])
+
+        footer_offset = out.tell()
+        for names in (action_codes, status_codes):
+            out.write(struct.pack("<I", len(names)))
+            out.write("".join(name + "\n" for name in names).encode())
+        out.write(COLUMNAR_TRAILER.pack(footer_offset, rows, COLUMNAR_MAGIC))
+
+    os.replace(tmp_path, out_path)
+    print(f"Converted {rows} rows from {filename} to {out_path}")
+
+
+def write_row_group(out, timestamps, user_ids, action_codes, status_codes):
+    columns = [array(narrow_typecode(values), values) for values in (user_ids, action_codes, status_codes)]
+    out.write(COLUMNAR_GROUP.pack(len(timestamps), "".join(column.typecode for column in columns).encode()))
+    out.write(timestamps.tobytes())
+    for column in columns:
+        out.write(column.tobytes())
+
+
+def read_columnar(path):
+    # Returns (rows, actions, statuses, row groups); every row group is
+    # (timestamps, user_ids, action_codes, status_codes), as NumPy arrays over the
+    # mapped file when NumPy is installed, else as array.array copies
+    with open(path, "rb") as file:
+        buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    footer_offset, rows, magic = COLUMNAR_TRAILER.unpack_from(buf, len(buf) - COLUMNAR_TRAILER.size)
+    if buf[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC or magic != COLUMNAR_MAGIC:
+        raise ValueError(f"{path} is not a columnar log file")
+
+    dictionaries = []
+    pos = footer_offset
+    for _ in range(2):
+        (count,) = struct.unpack_from("<I", buf, pos)
+        pos += 4
+        names = []
+        for _ in range(count):
+            end = buf.find(b"\n", pos)
+            names.append(buf[pos:end].decode())
+            pos = end + 1
+        dictionaries.append(names)
+
+    groups = []
+    pos = len(COLUMNAR_MAGIC)
+    while pos < footer_offset:
+        group_rows, typecodes = COLUMNAR_GROUP.unpack_from(buf, pos)
+        pos += COLUMNAR_GROUP.size
+        group = []
+        for typecode in "q" + typecodes.decode():
+            size = group_rows * array(typecode).itemsize
+            if np is not None:
+                group.append(np.frombuffer(buf, dtype=np.dtype(typecode), count=group_rows, offset=pos))
+            else:
+                column = array(typecode)
+                column.frombytes(buf[pos:pos + size])
+                group.append(column)
+            pos += size
+        groups.append(tuple(group))
+
+    return rows, dictionaries[0], dictionaries[1], groups
+
+
+def query_columnar(path, top_k=TOP_K):
+    # Same summary dict as LogAggregator.result()
+    rows, actions, statuses, groups = read_columnar(path)
+    fail_code = statuses.index("FAIL") if "FAIL" in statuses else -1
+
+    if np is not None:
+        user_count = NumpyUserCounter()
+        for group in groups:
+            user_count.add(group[1])
+        top_users, total_users = user_count.top(top_k), len(user_count)
+        failed_events = sum(int(np.count_nonzero(group[3] == fail_code)) for group in groups)
+    else:
+        user_count = Counter()
+        for group in groups:
+            user_count.update(group[1])
+        top_users = heapq.nlargest(top_k, user_count.items(), key=lambda x: x[1])
+        total_users = len(user_count)
+        failed_events = sum(group[3].count(fail_code) for group in groups)
+
+    return {
+        "top_users": top_users,
+        "total_users": total_users,
+        "total_events": rows,
+        "failed_events": failed_events,
+        "unique_actions": len(actions),
+    }
+
+
+def scan_windows(filename, window, top_k=TOP_K, sliding_minutes=SLIDING_MINUTES, distinct=DISTINCT):
+    stats = WindowedStats(window, top_k, sliding_minutes, distinct)
+    for block in iter_file_blocks(filename):
+        stats.feed_block(block)
+    return stats
+
+
+def build_index(filename, step=INDEX_STEP):
+    # Sparse index for a log written in time order: for every `step`-byte block, the offset
+    # of the first line starting in it and that line's timestamp. The index is kept next to
+    # the log and only extended when the log has grown; a new inode means a new file.
+    # Returns (timestamps, offsets).
+    index_path = filename + ".idx"
+    stat = os.stat(filename)
+    timestamps, offsets = array("q"), array("Q")
+    boundary = 0
+
+    try:
+        with open(index_path, "rb") as file:
+            magic, inode, size, next_boundary, saved_step, entries = INDEX_HEADER.unpack(file.read(INDEX_HEADER.size))
+            if magic == b"LPIDX1" and inode == stat.st_ino and saved_step == step and size <= stat.st_size:
+                timestamps.fromfile(file, entries)
+                offsets.fromfile(file, entries)
+                boundary = next_boundary
+    except (FileNotFoundError, struct.error, EOFError):
+        pass
+
+    if boundary >= stat.st_size:
+        return timestamps, offsets
+
+    with open(filename, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        size = len(buf)
+        while boundary < size:
+            pos = 0 if boundary == 0 else buf.find(b"\n", boundary - 1, size) + 1
+            if pos == 0 and boundary:
+                break
+
+            # First complete line at or after the boundary with a readable timestamp
+            timestamp = None
+            for _ in range(8):
+                line_end = buf.find(b"\n", pos, size)
+                if line_end < 0:
+                    break
+                pipe = buf.find(b"|", pos, line_end)
+                head = buf[pos:pipe if pipe >= 0 else line_end]
+                timestamp = parse_timestamp(head.strip().decode(errors="replace"))
+                if timestamp is not None:
+                    break
+                pos = line_end + 1
+
+            if timestamp is None and line_end < 0:
+                break   # only an unterminated line is left; index it once it is complete
+            if timestamp is not None and (not offsets or pos > offsets[-1]):
+                # Keep the index sorted even if a line is slightly out of order
+                timestamps.append(max(timestamp, timestamps[-1]) if timestamps else timestamp)
+                offsets.append(pos)
+            boundary += step
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(INDEX_HEADER.pack(b"LPIDX1", stat.st_ino, size, boundary, step, len(offsets)))
+        timestamps.tofile(file)
+        offsets.tofile(file)
+    os.replace(tmp_path, index_path)
+    return timestamps, offsets
+
+
+def scan_time_range(filename, start_text, end_text, capacity=SKETCH_CAPACITY, distinct=DISTINCT,
+                    failures=FAILURE_RATES):
+    # Top users and stats for lines with start <= timestamp < end. The index narrows the
+    # scan to the byte range that can hold those lines: from the last entry before `start`
+    # to the first entry at or after `end`. Broken lines in that range count as rejects.
+    start, end = parse_timestamp(start_text), parse_timestamp(end_text)
+    if start is None or end is None:
+        raise ValueError(f"cannot parse time range {start_text!r} - {end_text!r}")
+
+    timestamps, offsets = build_index(filename)
+    first = bisect_left(timestamps, start) - 1
+    last = bisect_left(timestamps, end)
+    start_offset = offsets[first] if first >= 0 else 0
+    end_offset = offsets[last] if last < len(offsets) else os.path.getsize(filename)
+
+    aggregator = LogAggregator(capacity, distinct, failures)
+    aggregator.feed_records((user_id, action, status, 1)
+                            for timestamp, user_id, action, status
+                            in iter_rows(filename, start_offset, end_offset, aggregator.rejects)
+                            if start <= timestamp < end)
+    return aggregator
+
+
+def parse_where(text):
+    # "status=FAIL AND action=DELETE" -> [(field index, negated, value)]; conditions are
+    # FIELD=VALUE or FIELD!=VALUE over QUERY_FIELDS, joined by AND
+    conditions = []
+    for term in re.split(r"\s+AND\s+", text.strip(), flags=re.IGNORECASE):
+        match = re.fullmatch(r"\s*(\w+)\s*(!?=)\s*(\S+)\s*", term)
+        if match is None or match[1].lower() not in QUERY_FIELDS:
+            raise ValueError(f"bad condition {term!r}: expected FIELD=VALUE or FIELD!=VALUE, "
+                             f"FIELD one of {', '.join(QUERY_FIELDS)}")
+        field = QUERY_FIELDS.index(match[1].lower())
+        value = match[3]
+        if field == 0:
+            if not value.isdecimal():
+                raise ValueError(f"bad condition {term!r}: user_id needs a number")
+            value = int(value)
+        conditions.append((field, match[2] == "!=", value))
+    return conditions
+
+
+class GroupByQuery:
+    # Count/distinct/top-K aggregates per group of records, grouped on any of QUERY_FIELDS
+    # and at most one time bucket, over the records that pass the `where` conditions.
+    # Blocks are tallied by line tail like the mmap engine (by bucket prefix and tail when
+    # grouping by time), and the conditions are pushed down to bytes: a block lacking a
+    # wanted value is skipped whole, and a tail lacking one is dropped without being
+    # decoded or split. Only the surviving distinct tails are parsed, once each.
+    # Lines that are dropped unparsed are not checked, so a query counts no rejects.
+    # Shards merged in file order give the serial result; ties rank by first appearance.
+
+    def __init__(self, group_by="", where=None, aggregates=AGGREGATES, top_k=TOP_K):
+        names = [name.strip().lower() for name in group_by.split(",") if name.strip()]
+        unknown = [name for name in names if name not in QUERY_FIELDS and name not in QUERY_BUCKETS]
+        buckets = [name for name in names if name in QUERY_BUCKETS]
+        if unknown or len(buckets) > 1:
+            raise ValueError(f"bad group-by {group_by!r}: fields are {', '.join(QUERY_FIELDS)} "
+                             f"and at most one of {', '.join(QUERY_BUCKETS)}")
+        self.columns = names
+        self.fields = [QUERY_FIELDS.index(name) if name in QUERY_FIELDS else None for name in names]
+        self.bucket = QUERY_BUCKETS[buckets[0]] if buckets else None
+
+        self.aggregates = []   # (kind, field index) for the "distinct" and "top" aggregates
+        for aggregate in (name.strip().lower() for name in aggregates.split(",") if name.strip()):
+            kind, _, field = aggregate.partition(":")
+            if aggregate == "count":
+                continue   # always there: groups are ranked by it
+            elif kind in ("distinct", "top") and field in QUERY_FIELDS:
+                self.aggregates.append((kind, QUERY_FIELDS.index(field)))
+            else:
+                raise ValueError(f"bad aggregate {aggregate!r}: use count, distinct:FIELD or top:FIELD, "
+                                 f"FIELD one of {', '.join(QUERY_FIELDS)}")
+
+        self.where = parse_where(where) if where else []
+        # Only action/status values are pushed down: a USER_ID can be written in ways
+        # that int() reads as the same number ("+7", "0_7"), so ids are compared parsed
+        self.needles = [value.encode() for field, negated, value in self.where if field and not negated]
+        self.top_k = top_k
+        self.groups = {}   # group key -> [count, distinct sets / top Counters...]
+        self.parsed = {}   # line tail -> record, or None if broken or filtered out
+        self.labels = {}   # bucket prefix -> bucket label, or None if not a timestamp
+
+    def matches(self, record):
+        return all((record[field] == value) != negated for field, negated, value in self.where)
+
+    def label(self, prefix):
+        # "2026-01-08 14" -> "2026-01-08 14:00" (hour bucket); None unless it starts a timestamp
+        text = prefix.decode(errors="replace")
+        seconds = parse_timestamp(text + "0000-01-01 00:00:00"[len(text):])
+        if seconds is None:
+            return None
+        return time.strftime("%Y-%m-%d" if self.bucket == 10 else "%Y-%m-%d %H:%M", time.gmtime(seconds))
+
+    def feed_block(self, block):
+        # Adds a newline-aligned block of lines
+        if not block or any(needle not in block for needle in self.needles):
+            return
+        lines = block.split(b"\n")
+        if block.endswith(b"\n"):
+            lines.pop()
+        tails = map(itemgetter(slice(tail_width(block, lines), None)), lines)
+        if self.bucket is None:
+            keys = ((None, tail, count) for tail, count in Counter(tails).items())
+        else:
+            prefixes = map(itemgetter(slice(self.bucket)), lines)
+            keys = ((prefix, tail, count) for (prefix, tail), count in Counter(zip(prefixes, tails)).items())
+
+        parsed = self.parsed
+        needles = self.needles
+        for prefix, tail, count in keys:
+            if tail in parsed:
+                record = parsed[tail]
+            else:
+                record = None
+                if all(needle in tail for needle in needles):
+                    record = check_fields(tail)[0]
+                    if record is not None and not self.matches(record):
+                        record = None
+                if len(parsed) < TAIL_CACHE_SIZE:
+                    parsed[tail] = record
+            if record is None:
+                continue
+
+            key = tuple(record[field] for field in self.fields if field is not None)
+            if prefix is not None:
+                label = self.labels.get(prefix, False)
+                if label is False:
+                    label = self.labels[prefix] = self.label(prefix)
+                if label is None:
+                    continue   # valid fields behind something that is not a timestamp
+                key += (label,)
+            self.add(key, record, count)
+
+    def add(self, key, record, count):
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0] + [set() if kind == "distinct" else Counter()
+                                             for kind, _ in self.aggregates]
+        group[0] += count
+        for state, (kind, field) in zip(group[1:], self.aggregates):
+            if kind == "distinct":
+                state.add(record[field])
+            else:
+                state[record[field]] += count
+
+    def merge(self, other):
+        # Adds `other` (the groups of a later part of the log) into this one
+        for key, theirs in other.groups.items():
+            mine = self.groups.get(key)
+            if mine is None:
+                self.groups[key] = theirs
+                continue
+            mine[0] += theirs[0]
+            for state, their_state in zip(mine[1:], theirs[1:]):
+                state.update(their_state)
+        return self
+
+    def rows(self, limit=QUERY_LIMIT):
+        # [(group values, count, aggregate values)], largest count first; an aggregate value
+        # is a number of distinct values or a [(value, count)] top-K list
+        groups = sorted(self.groups.items(), key=lambda x: -x[1][0])
+        if limit:
+            groups = groups[:limit]
+        return [(key, group[0], [len(state) if kind == "distinct" else state.most_common(self.top_k)
+                                 for state, (kind, _) in zip(group[1:], self.aggregates)])
+                for key, group in groups]
+
+    def headers(self):
+        # The bucket column comes last, as in the group keys
+        columns = [name for name in self.columns if name in QUERY_FIELDS]
+        columns += [name for name in self.columns if name in QUERY_BUCKETS]
+        return columns, [f"{kind}({QUERY_FIELDS[field]})" for kind, field in self.aggregates]
+
+
+def scan_query_range(filename, start, end, spec):
+    # One shard of scan_query: a GroupByQuery(*spec) over the lines starting in [start, end)
+    # of a plain log, or over all of a compressed one (start None)
+    query = GroupByQuery(*spec)
+    blocks = iter_file_blocks(filename) if start is None else iter_mmap_blocks(filename, start, end)
+    for block in blocks:
+        query.feed_block(block)
+    return query
+
+
+def scan_query(filenames, group_by="", where=None, aggregates=AGGREGATES, top_k=TOP_K, workers=1):
+    # Runs a group-by query over one or more logs: the shard_jobs of all files run in one
+    # process pool and are merged in file order
+    spec = (group_by, where, aggregates, top_k)
+    GroupByQuery(*spec)   # raise on a bad query before starting workers
+    jobs = shard_jobs(filenames, workers, spec)
+
+    if workers == 1 or len(jobs) == 1:
+        shards = [scan_query_range(*job) for job in jobs]
+    else:
+        with Pool(min(workers, len(jobs))) as pool:
+            shards = pool.starmap(scan_query_range, jobs)
+    return merge_results(shards)
+
+
+def print_query(query, limit=QUERY_LIMIT):
+    columns, aggregates = query.headers()
+    rows = query.rows(limit)
+    table = [[str(value) for value in key] + [str(count)] +
+             [str(value) if isinstance(value, int) else ", ".join(f"{v}:{c}" for v, c in value) for value in values]
+             for key, count, values in rows]
+    header = columns + ["count"] + aggregates
+    widths = [max([len(name)] + [len(row[i]) for row in table]) for i, name in enumerate(header)]
+    for row in [header] + table:
+        # The last column (often a top-K list) is not padded
+        print("".join(cell.ljust(width + 2) for cell, width in zip(row[:-1], widths)) + row[-1])
+
+    total = sum(group[0] for group in query.groups.values())
+    print(f"\n{len(query.groups)} groups, {total} matching events")
+
+
+class WatchFilter:
+    # Membership test for a watchlist of user ids. Ids in [0, DENSE_USER_LIMIT) go in a
+    # bitmap (at most 2 MiB, exact); a list with larger or negative ids gets a Bloom filter
+    # sized for BLOOM_FP_RATE, whose rare hits are confirmed by bisecting the sorted ids,
+    # so both kinds answer exactly. Saved next to the watchlist as PATH.filter and reused
+    # while the watchlist keeps its size and mtime.
+
+    def __init__(self, user_ids, fp_rate=BLOOM_FP_RATE):
+        ids = sorted(set(user_ids))
+        self.size = len(ids)
+        if not ids or (ids[0] >= 0 and ids[-1] < DENSE_USER_LIMIT):
+            self.hashes = 0
+            self.ids = None
+            self.bits = bytearray((ids[-1] >> 3) + 1 if ids else 0)
+            for user_id in ids:
+                self.bits[user_id >> 3] |= 1 << (user_id & 7)
+        else:
+            nbits = max(64, math.ceil(-len(ids) * math.log(fp_rate) / math.log(2) ** 2))
+            self.hashes = max(1, round(nbits / len(ids) * math.log(2)))
+            self.ids = array("q", ids)
+            self.bits = bytearray((nbits + 7) >> 3)
+            for user_id in ids:
+                for position in self.positions(user_id):
+                    self.bits[position >> 3] |= 1 << (position & 7)
+
+    def positions(self, user_id):
+        # Bloom filter bits of an id, by double hashing of one 64-bit hash
+        hashed = mix64(user_id & 0xFFFFFFFFFFFFFFFF)
+        low, high = hashed & 0xFFFFFFFF, (hashed >> 32) | 1
+        nbits = len(self.bits) << 3
+        return [(low + i * high) % nbits for i in range(self.hashes)]
+
+    def __contains__(self, user_id):
+        bits = self.bits
+        if self.ids is None:
+            return 0 <= user_id < len(bits) << 3 and bits[user_id >> 3] >> (user_id & 7) & 1
+        if not all(bits[position >> 3] >> (position & 7) & 1 for position in self.positions(user_id)):
+            return False
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def save(self, path, source_stat):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(FILTER_HEADER.pack(b"LPWF01", self.ids is not None, source_stat.st_size,
+                                          source_stat.st_mtime_ns, len(self.bits) << 3, self.hashes, self.size))
+            file.write(self.bits)
+            if self.ids is not None:
+                self.ids.tofile(file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_stat=None):
+        # The saved filter, or None if it is missing, damaged or older than the watchlist
+        try:
+            with open(path, "rb") as file:
+                magic, is_bloom, size, mtime, nbits, hashes, users = FILTER_HEADER.unpack(file.read(FILTER_HEADER.size))
+                if magic != b"LPWF01" or (source_stat and (size, mtime) != (source_stat.st_size,
+                                                                            source_stat.st_mtime_ns)):
+                    return None
+                watch = cls.__new__(cls)
+                watch.size = users
+                watch.hashes = hashes
+                watch.bits = bytearray(file.read(nbits >> 3))
+                watch.ids = None
+                if is_bloom:
+                    watch.ids = array("q")
+                    watch.ids.fromfile(file, users)
+                if len(watch.bits) != nbits >> 3:
+                    return None
+                return watch
+        except (FileNotFoundError, struct.error, EOFError):
+            return None
+
+
+def load_watchlist(path):
+    # WatchFilter for a watchlist file (one USER_ID per line, blank lines and #-comments
+    # skipped), or for a saved PATH.filter given directly
+    if path.endswith(".filter"):
+        watch = WatchFilter.load(path)
+        if watch is None:
+            raise ValueError(f"{path} is not a watchlist filter")
+        return watch
+
+    stat = os.stat(path)
+    watch = WatchFilter.load(path + ".filter", stat)
+    if watch is None:
+        with open(path) as file:
+            lines = [line.split("#")[0].strip() for line in file]
+        bad = [line for line in lines if line and not line.lstrip("-").isdecimal()]
+        if bad:
+            raise ValueError(f"{path}: not a USER_ID: {bad[0]!r}")
+        watch = WatchFilter(int(line) for line in lines if line)
+        watch.save(path + ".filter", stat)
+    return watch
+
+
+def iter_watch_block(block, watch, matched):
+    # Yields the lines of a newline-aligned block whose user is in `watch`, whole and in
+    # order. Each distinct line tail is checked once (cached in `matched`): its USER_ID
+    # bytes are tested against the filter first, and only a hit is decoded and checked
+    # as a full line. Blocks without a hit cost one C-level pass over their lines.
+    lines = block.split(b"\n")
+    if block.endswith(b"\n"):
+        lines.pop()
+    tails = list(map(itemgetter(slice(tail_width(block, lines), None)), lines))
+
+    hits = set()
+    for tail in dict.fromkeys(tails):
+        hit = matched.get(tail)
+        if hit is None:
+            fields = tail.split(b"|", 3)
+            user_id = fields[1].split(b"=", 2) if len(fields) == 4 else ()
+            if len(user_id) > 1 and user_id[1].strip().isdigit():
+                hit = int(user_id[1]) in watch and check_fields(tail)[0] is not None
+            else:
+                # Broken, or an id in another form int() takes ("+7"): check the whole line
+                record = check_fields(tail)[0]
+                hit = record is not None and record[0] in watch
+            if len(matched) < TAIL_CACHE_SIZE:
+                matched[tail] = hit
+        if hit:
+            hits.add(tail)
+
+    if hits:
+        yield from compress(lines, map(hits.__contains__, tails))
+
+
+def iter_watch_range(filename, start, end, watch):
+    # The matching lines of one shard: [start, end) of a plain log, or a whole compressed one
+    matched = {}
+    blocks = iter_file_blocks(filename) if start is None else iter_mmap_blocks(filename, start, end)
+    for block in blocks:
+        yield from iter_watch_block(block, watch, matched)
+
+
+def match_watch_range(job):
+    # Pool task for scan_watchlist: (filename, start, end, watch) -> matching lines
+    return list(iter_watch_range(*job))
+
+
+def scan_watchlist(filenames, watch, workers=1):
+    # Yields the lines of watched users from one or more logs in file order. A serial scan
+    # streams them as found; with workers the shards (as in scan_query) are matched in a
+    # process pool and their lines yielded in order as each shard completes.
+    jobs = shard_jobs(filenames, workers, watch)
+
+    if workers == 1:
+        for job in jobs:
+            yield from iter_watch_range(*job)
+        return
+
+    with Pool(min(workers, len(jobs))) as pool:
+        for lines in pool.imap(match_watch_range, jobs):
+            yield from lines
+
+
+class Sessionizer:
+    # Streaming pairing of LOGIN/LOGOUT into per-user sessions. Only SUCCESS events count.
+    # A LOGIN opens a session (closing one still open, as "relogin"); a LOGOUT closes it;
+    # UPLOAD/DOWNLOAD events in between are counted on it. A session with no activity for
+    # `timeout` seconds is closed at its last activity ("timeout"), and the ones left at
+    # the end of the log as "end". Open sessions sit in an OrderedDict by last activity,
+    # so eviction only looks at the oldest ones and memory stays proportional to the
+    # users with an open session, not to the events. Durations and per-session upload
+    # and download counts go into fixed histograms; the number of open sessions is
+    # sampled per `bucket` (peak and count at the bucket's end).
+
+    def __init__(self, timeout=SESSION_TIMEOUT * 60, bucket="hour"):
+        self.timeout = timeout
+        self.width = WINDOW_SECONDS[bucket]
+        self.open = OrderedDict()   # user_id -> [start, last activity, uploads, downloads]
+        self.now = None   # latest timestamp seen
+        self.ended = Counter()   # end reason -> sessions
+        self.durations = [0] * len(SESSION_DURATION_LABELS)
+        self.total_duration = 0
+        self.max_duration = 0
+        self.uploads = [0] * (SESSION_COUNT_CAP + 1)
+        self.downloads = [0] * (SESSION_COUNT_CAP + 1)
+        self.outside = Counter()   # action -> SUCCESS events with no open session
+        self.concurrent = []   # (bucket start, peak open sessions, open sessions at the end)
+        self.bucket = None
+        self.peak = 0
+
+    def add(self, timestamp, user_id, action, status):
+        if status != "SUCCESS" or timestamp == NO_TIMESTAMP:
+            return
+        if self.now is None or timestamp > self.now:
+            self.now = timestamp
+            self.evict(timestamp)
+            self.sample(timestamp)
+
+        session = self.open.get(user_id)
+        if action == "LOGIN":
+            if session is not None:
+                self.close(user_id, session[1], "relogin")
+            self.open[user_id] = [timestamp, timestamp, 0, 0]
+        elif session is None:
+            self.outside[action] += 1
+            return
+        elif action == "LOGOUT":
+            self.close(user_id, timestamp, "logout")
+        else:
+            session[1] = max(session[1], timestamp)
+            if action == "UPLOAD":
+                session[2] += 1
+            elif action == "DOWNLOAD":
+                session[3] += 1
+            self.open.move_to_end(user_id)
+        if len(self.open) > self.peak:
+            self.peak = len(self.open)
+
+    def evict(self, now):
+        # Closes the sessions idle for longer than the timeout, oldest activity first
+        open_sessions = self.open
+        while open_sessions:
+            user_id, session = next(iter(open_sessions.items()))
+            if session[1] + self.timeout >= now:
+                break
+            self.close(user_id, session[1], "timeout")
+
+    def sample(self, now):
+        # Moves on to the concurrency bucket of `now`, recording the finished one
+        bucket = now - now % self.width
+        if bucket != self.bucket:
+            if self.bucket is not None:
+                self.concurrent.append((self.bucket, self.peak, len(self.open)))
+            self.bucket = bucket
+            self.peak = len(self.open)
+
+    def close(self, user_id, end, reason):
+        start, _, uploads, downloads = self.open.pop(user_id)
+        duration = max(end - start, 0)
+        self.ended[reason] += 1
+        self.durations[bisect_right(SESSION_DURATIONS, duration)] += 1
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.uploads[min(uploads, SESSION_COUNT_CAP)] += 1
+        self.downloads[min(downloads, SESSION_COUNT_CAP)] += 1
+
+    def finish(self):
+        # Closes what is still open at the end of the log and records the last bucket
+        if self.bucket is not None:
+            self.concurrent.append((self.bucket, self.peak, len(self.open)))
+            self.bucket = None
+        for user_id, session in list(self.open.items()):
+            self.close(user_id, session[1], "end")
+
+
+def scan_sessions(filenames, timeout=SESSION_TIMEOUT * 60, bucket=SESSION_BUCKET, rejects=None):
+    # Sessionizes one or more logs read one after the other (e.g. hourly files in order),
+    # so sessions carry over from one file to the next
+    sessions = Sessionizer(timeout, bucket)
+    for filename in filenames:
+        for timestamp, user_id, action, status in iter_rows(filename, rejects=rejects):
+            sessions.add(timestamp, user_id, action, status)
+    sessions.finish()
+    return sessions
+
+
+def print_sessions(sessions):
+    total = sum(sessions.ended.values())
+    print(f"{'Bucket':<18}{'Peak':>8}{'At end':>8}  Concurrent sessions")
+    for start, peak, at_end in sessions.concurrent:
+        print(f"{format_minute(start):<18}{peak:>8}{at_end:>8}")
+
+    print("\nSessions       :", total, "(" + ", ".join(f"{reason} {count}" for reason, count in
+                                                   sorted(sessions.ended.items())) + ")" if total else "")
+    if total:
+        print(f"Mean Duration  : {sessions.total_duration / total / 60:.1f} min "
+              f"(max {sessions.max_duration / 60:.1f} min)")
+    if sessions.outside:
+        print("Outside Session:", ", ".join(f"{action} {count}" for action, count in sorted(sessions.outside.items())))
+
+    print(f"\n{'Duration':<10}{'Sessions':>10}")
+    for label, count in zip(SESSION_DURATION_LABELS, sessions.durations):
+        print(f"{label:<10}{count:>10}")
+
+    print(f"\n{'Per session':<12}{'Uploads':>10}{'Downloads':>10}")
+    for count, (uploads, downloads) in enumerate(zip(sessions.uploads, sessions.downloads)):
+        label = f"{count}+" if count == SESSION_COUNT_CAP else str(count)
+        print(f"{label:<12}{uploads:>10}{downloads:>10}")
+
+
+def format_minute(seconds):
+    return time.strftime("%Y-%m-%d %H:%M", time.gmtime(seconds))
+
+
+def print_windows(stats):
+    distinct = stats.all_users is not None
+    print(f"{'Window':<18}{'Events':>10}{'Failed':>10}" + (f"{'Users':>8}" if distinct else "") + "  Top Users")
+    for start, events, failed, top_users, users_seen in stats.windows():
+        users = ", ".join(f"{user}:{count}" for user, count in top_users)
+        seen = f"{users_seen:>8}" if distinct else ""
+        print(f"{format_minute(start):<18}{events:>10}{failed:>10}{seen}  {users}")
+    if distinct:
+        approx = " (approximate)" if isinstance(stats.all_users, HyperLogLog) else ""
+        print(f"\nDistinct users over all windows{approx}:", len(stats.all_users))
+
+    if stats.ring:
+        minutes = len(stats.ring)
+        print(f"\nFailures in last {minutes} min:", stats.sliding_failed,
+              f"(as of {format_minute(stats.ring_minute * 60)})" if stats.ring_minute is not None else "")
+        if stats.peak[1] is not None:
+            print(f"Peak over {minutes} min      :", stats.peak[0], f"(at {format_minute(stats.peak[1] * 60)})")
+
+
+def print_report(summary):
+    # Prints a summary dict from LogAggregator.result(), scan_numpy() or query_columnar()
+    if summary["total_users"] is None:
+        # True count of each user is within [count - error, count]
+        print("Top Users (approximate):")
+        for user, count, error in summary["top_users"]:
+            print(user, count, f"(error <= {error})")
+    else:
+        print("Top Users:")
+        for user, count in summary["top_users"]:
+            print(user, count)
+
+    print("\nStats:")
+    if summary["total_users"] is None:
+        if "estimated_users" in summary:
+            print("Total Users    : ~" + str(summary["estimated_users"]), "(HyperLogLog; tracking",
+                  summary["tracked_users"], "of max", summary["capacity"], "counters)")
+        else:
+            print("Total Users    : n/a (tracking", summary["tracked_users"], "of max", summary["capacity"], "counters)")
+        print("Max Count Error:", summary["max_error"])
+    else:
+        print("Total Users    :", summary["total_users"])
+    print("Total Events   :", summary["total_events"])
+    print("Failed Events  :", summary["failed_events"])
+    print("Unique Actions :", summary["unique_actions"])
+    if "rejects" in summary:
+        reasons = ", ".join(f"{reason} {count}" for reason, count in summary["rejects"].items() if count)
+        print("Rejected Lines :", sum(summary["rejects"].values()), *[f"({reasons})"] if reasons else [])
+    if "failures" in summary:
+        failures = summary["failures"]
+        print(f"\nTop Failure Rates (>= {failures['min_support']} events):")
+        for user, fails, events, rate in failures["top_rates"]:
+            print(user, f"{rate:.1%}", f"({fails}/{events})")
+        print(f"Anomalous Users: {failures['flagged']} (z >= {failures['threshold']:g})")
+        for user, fails, events, rate, z in failures["anomalies"]:
+            print(user, f"{rate:.1%}", f"({fails}/{events})", f"z={z:.2f}")
+    if "distinct" in summary:
+        distinct = summary["distinct"]
+        print("\nDistinct Users" + (" (approximate):" if distinct["mode"] == "approx" else ":"))
+        for name, counts in (("action", distinct["actions"]), ("status", distinct["statuses"])):
+            for key, users in counts.items():
+                print(f"  {name} {key:<10}: {users}")
+
+
+def follow_file(filename, interval=REFRESH_INTERVAL, capacity=SKETCH_CAPACITY, checkpoint=None, top_k=TOP_K,
+                failures=FAILURE_RATES, min_support=MIN_SUPPORT, threshold=ANOMALY_Z):
+    # Reads FILE_NAME from the start (or from the checkpoint), then only the bytes appended
+    # after the last read. The open handle's inode is compared to the path's on every EOF:
+    # a new inode means the file was rotated (the old handle is already drained, so counting
+    # just continues on the new file), a smaller size means it was truncated in place.
+    # The checkpoint, if any, is saved with every report (without failure stats, so
+    # `failures` needs checkpoint=None; main() rejects the two together).
+    aggregator = LogAggregator(capacity, failures=failures)
+    tail_parser = TailParser()
+    file = None
+    checkpoint_ready = False   # only once a file is open, so a stale checkpoint is never overwritten early
+    inode = None
+    offset = 0
+    pending = b""   # partial last line, completed by the next read
+    next_report = time.monotonic() + interval
+
+    try:
+        while True:
+            if file is None:
+                try:
+                    file = open(filename, "rb")
+                except FileNotFoundError:
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                stat = os.fstat(file.fileno())
+                inode = stat.st_ino
+                offset = 0
+
+                # Only the first file opened can continue a checkpoint; after a rotation
+                # a recycled inode number must not bring back the old file's state
+                state = None if checkpoint_ready else resume_state(checkpoint, inode, stat.st_size, capacity)
+                if state is not None:
+                    offset, aggregator = state[1:]
+                    file.seek(offset)
+                    print(f"Resuming {filename} from byte {offset}")
+                checkpoint_ready = checkpoint is not None
+
+            chunk = file.read(BLOCK_SIZE)
+            if chunk:
+                data = pending + chunk
+                cut = data.rfind(b"\n") + 1
+                aggregator.feed_records(iter_block_records(data[:cut], tail_parser, aggregator.rejects))
+                offset += len(chunk)
+                pending = data[cut:]
+            else:
+                try:
+                    stat = os.stat(filename)
+                except FileNotFoundError:
+                    stat = None
+
+                if stat is None or stat.st_ino != inode:
+                    # Rotated: the unterminated last line of the old file is complete now
+                    aggregator.feed_records(iter_block_records(pending, tail_parser, aggregator.rejects))
+                    pending = b""
+                    file.close()
+                    file = None
+                    continue
+
+                if stat.st_size < offset:
+                    # Truncated in place: start over from the beginning of the same inode
+                    file.seek(0)
+                    offset = 0
+                    pending = b""
+                    continue
+
+                time.sleep(POLL_INTERVAL)
+
+            if time.monotonic() >= next_report:
+                print(f"\n=== {time.strftime('%Y-%m-%d %H:%M:%S')} | inode {inode} | offset {offset} ===")
+                print_report(aggregator.result(top_k, min_support, threshold))
+                if checkpoint_ready:
+                    save_checkpoint(checkpoint, inode, offset - len(pending), aggregator)
+                next_report = time.monotonic() + interval
+    except KeyboardInterrupt:
+        # No checkpoint here: an interrupted feed may have counted part of a chunk
+        pass
+    finally:
+        if file is not None:
+            file.close()
+
+    return aggregator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Top users and stats for a `ts | USER_ID= | ACTION= | STATUS=` log.")
+    parser.add_argument("file", nargs="?", default=FILE_NAME,
+                        help=f"log file, plain or gzip/zstd-compressed, or a directory or quoted glob "
+                             f"of them (default: {FILE_NAME})")
+    parser.add_argument("-k", "--top-k", type=int, default=TOP_K, help=f"number of top users (default: {TOP_K})")
+    parser.add_argument("-e", "--engine", choices=["text", "mmap", "numpy"], default=ENGINE,
+                        help=f"parser/aggregation engine (default: {ENGINE})")
+    parser.add_argument("-w", "--workers", type=int, default=WORKERS,
+                        help=f"processes for the text/mmap engines; with several files, files scanned "
+                             f"at once (default: {WORKERS})")
+    parser.add_argument("--sketch-capacity", type=int, default=SKETCH_CAPACITY, metavar="N",
+                        help="approximate top-K with at most N user counters (default: exact)")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--follow", action="store_true", default=FOLLOW, help="keep reading appended lines")
+    parser.add_argument("--interval", type=float, default=REFRESH_INTERVAL,
+                        help=f"seconds between follow-mode reports (default: {REFRESH_INTERVAL})")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, metavar="PATH",
+                        help="checkpoint file to save to and resume from (also with --follow)")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, metavar="BYTES",
+                        help=f"bytes scanned between checkpoints (default: {CHECKPOINT_EVERY})")
+    modes.add_argument("--window", choices=sorted(WINDOW_SECONDS), default=WINDOW,
+                       help="report events, failures and top users per window")
+    parser.add_argument("--sliding-minutes", type=int, default=SLIDING_MINUTES, metavar="N",
+                        help=f"window mode: also track failures over the last N minutes (default: {SLIDING_MINUTES})")
+    modes.add_argument("--time-range", nargs=2, default=TIME_RANGE, metavar=("START", "END"),
+                       help='only lines with START <= timestamp < END, e.g. "2026-01-08 14:00:00"')
+    modes.add_argument("--columnar", default=COLUMNAR_FILE, metavar="PATH",
+                       help="convert the log to this columnar file once and query it")
+    parser.add_argument("--quarantine", default=QUARANTINE_FILE, metavar="PATH",
+                        help=f"write up to {QUARANTINE_SAMPLES} sample broken lines per reject reason here")
+    parser.add_argument("--distinct", choices=["exact", "approx"], default=DISTINCT,
+                        help="also count distinct users per action and status: exact (sets) or "
+                             "approx (HyperLogLog, fixed memory)")
+    parser.add_argument("--failure-rates", action="store_true", default=FAILURE_RATES,
+                        help="rank users by failure rate and flag anomalous ones")
+    parser.add_argument("--min-support", type=int, default=MIN_SUPPORT, metavar="N",
+                        help=f"events a user needs to be ranked or flagged (default: {MIN_SUPPORT})")
+    parser.add_argument("--anomaly-z", type=float, default=ANOMALY_Z, metavar="Z",
+                        help=f"flag users this many standard deviations above the failure rate (default: {ANOMALY_Z})")
+    parser.add_argument("--group-by", default=GROUP_BY, metavar="FIELDS",
+                        help=f"count events per group of {', '.join(QUERY_FIELDS)} and at most one of "
+                             f"{', '.join(QUERY_BUCKETS)}, e.g. action,status")
+    parser.add_argument("--where", default=WHERE, metavar="EXPR",
+                        help='only count lines matching all conditions, e.g. "status=FAIL AND action=DELETE"')
+    parser.add_argument("--aggregates", default=AGGREGATES, metavar="LIST",
+                        help=f"per group: count, distinct:FIELD, top:FIELD (top -k values) (default: {AGGREGATES})")
+    parser.add_argument("--limit", type=int, default=QUERY_LIMIT, metavar="N",
+                        help="print only the N largest groups (default: all)")
+    modes.add_argument("--watchlist", default=WATCHLIST, metavar="PATH",
+                       help="print the lines of the USER_IDs listed in PATH (one per line); the filter "
+                            "built from it is kept as PATH.filter for later runs")
+    modes.add_argument("--sessions", action="store_true", default=SESSIONS,
+                       help="pair LOGIN/LOGOUT per user into sessions: durations, concurrency, uploads/downloads")
+    parser.add_argument("--session-timeout", type=float, default=SESSION_TIMEOUT, metavar="MINUTES",
+                        help=f"close sessions idle this long (default: {SESSION_TIMEOUT})")
+    parser.add_argument("--session-bucket", choices=sorted(WINDOW_SECONDS), default=SESSION_BUCKET,
+                        help=f"report concurrent sessions per bucket (default: {SESSION_BUCKET})")
+    parser.add_argument("--phase-stats", action="store_true", default=PHASE_STATS,
+                        help="time reading, parsing and counting separately and report them (on stderr)")
+    parser.add_argument("--progress", type=float, default=PROGRESS_INTERVAL, metavar="SECONDS",
+                        help="print a progress line (on stderr) this often during the scan")
+    parser.add_argument("--profile", default=PROFILE_FILE, metavar="PATH",
+                        help="run under cProfile, dump the pstats data to PATH and list the hottest functions "
+                             "(pool workers are not profiled; use -w 1)")
+    args = parser.parse_args(argv)
+
+    query = args.group_by is not None or args.where is not None
+    given = {"query": query, "numpy": args.engine == "numpy", "scan": True}   # the modes that are not an option
+    mode = next(name for name in MODE_OPTIONS if given.get(name, getattr(args, name, None)))
+    label = {"query": "--group-by/--where", "numpy": "-e numpy", "scan": "a plain scan"}.get(
+        mode, "--" + mode.replace("_", "-"))
+    for dest in sorted(set(chain(MODE_OPTIONS, *MODE_OPTIONS.values())) - set(given) - set(MODE_OPTIONS[mode]) - {mode}):
+        if getattr(args, dest) != parser.get_default(dest):
+            option = f"-e {args.engine}" if dest == "engine" else "--" + dest.replace("_", "-")
+            parser.error(f"{option} does not apply to {label}")
+    if not args.failure_rates and (args.min_support != MIN_SUPPORT or args.anomaly_z != ANOMALY_Z):
+        parser.error("--min-support and --anomaly-z need --failure-rates")
+    if args.failure_rates and args.checkpoint:
+        parser.error("--failure-rates cannot be resumed: a checkpoint does not keep per-user failures")
+    if (args.phase_stats or args.progress) and args.workers > 1:
+        parser.error("--phase-stats and --progress instrument a serial (-w 1) scan")
+
+    if args.workers < 1:
+        parser.error("-w/--workers must be at least 1")
+    if args.sketch_capacity < 0:
+        parser.error("--sketch-capacity must be 0 (exact) or more")
+    if args.interval <= 0 or args.checkpoint_every <= 0:
+        parser.error("--interval and --checkpoint-every must be positive")
+    if args.time_range:
+        start, end = map(parse_timestamp, args.time_range)
+        if start is None or end is None:
+            parser.error(f"cannot parse --time-range {args.time_range[0]!r} {args.time_range[1]!r}; "
+                         f"use \"YYYY-MM-DD HH:MM:SS\"")
+        if start >= end:
+            parser.error("--time-range START must come before END")
+
+    if args.watchlist:
+        try:
+            args.watch = load_watchlist(args.watchlist)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    if query:
+        try:
+            GroupByQuery(args.group_by or "", args.where, args.aggregates, args.top_k)
+        except ValueError as error:
+            parser.error(str(error))
+
+    files = expand_inputs(args.file, (args.checkpoint, args.columnar, args.quarantine, args.profile))
+    if not files:
+        parser.error(f"no log files match {args.file}")
+    if mode != "follow" and not os.path.isfile(files[0]):
+        parser.error(f"{files[0]} is not a log file (missing, or not a regular file)")   # --follow waits for it
+    if mode in ("query", "watchlist", "sessions"):
+        pass   # any number of files, plain or compressed
+    elif len(files) > 1:
+        if mode != "scan":
+            parser.error("several input files need a plain scan with the text or mmap engine")
+        if args.phase_stats or args.progress:
+            parser.error("--phase-stats and --progress instrument the scan of a single file")
+    elif mode in ("follow", "checkpoint", "time_range") and os.path.exists(files[0]) and compression_of(files[0]):
+        parser.error(f"{files[0]} is compressed; --follow, --checkpoint and --time-range need an uncompressed log")
+
+    if not args.profile:
+        run(args, files)
+        return
+
+    # Only this process is profiled: with -w > 1 the pool workers' parsing does not show up
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, args, files)
+    finally:
+        profiler.dump_stats(args.profile)
+        print(f"\nProfile written to {args.profile}; top {PROFILE_TOP} by cumulative time:", file=sys.stderr)
+        pstats.Stats(args.profile, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+
+def run(args, files):
+    # Runs the mode main() picked and prints its report
+    if args.sessions:
+        rejects = RejectCounter()
+        print_sessions(scan_sessions(files, args.session_timeout * 60, args.session_bucket, rejects))
+        if args.quarantine:
+            write_quarantine(args.quarantine, rejects)
+        return
+    if args.watchlist:
+        out = sys.stdout.buffer
+        lines = 0
+        for line in scan_watchlist(files, args.watch, args.workers):
+            out.write(line + b"\n")
+            lines += 1
+        out.flush()
+        print(f"{lines} lines of {args.watch.size} watched users", file=sys.stderr)
+        return
+    if args.group_by is not None or args.where is not None:
+        print_query(scan_query(files, args.group_by or "", args.where, args.aggregates, args.top_k, args.workers),
+                    args.limit)
+        return
+    if len(files) > 1:
+        aggregator = scan_files(files, args.workers, args.engine, args.sketch_capacity,
+                                distinct=args.distinct, failures=args.failure_rates)
+        print_report(aggregator.result(args.top_k, args.min_support, args.anomaly_z))
+        if args.quarantine:
+            write_quarantine(args.quarantine, aggregator.rejects)
+        return
+    filename = files[0]
 
+    rejects = None   # the RejectCounter of the modes that account for broken lines
+    if args.columnar:
+        if not os.path.exists(args.columnar) or os.path.getmtime(args.columnar) < os.path.getmtime(filename):
+            convert_to_columnar(filename, args.columnar)
+        print_report(query_columnar(args.columnar, args.top_k))
+    elif args.time_range:
+        aggregator = scan_time_range(filename, *args.time_range, args.sketch_capacity, args.distinct,
+                                     args.failure_rates)
+        print_report(aggregator.result(args.top_k, args.min_support, args.anomaly_z))
+        rejects = aggregator.rejects
+    elif args.window:
+        print_windows(scan_windows(filename, args.window, args.top_k, args.sliding_minutes, args.distinct))
+    elif args.engine == "numpy":
+        rejects = RejectCounter()
+        print_report(scan_numpy(filename, args.top_k, rejects))
+    elif args.follow:
+        aggregator = follow_file(filename, args.interval, args.sketch_capacity, args.checkpoint, args.top_k,
+                                 args.failure_rates, args.min_support, args.anomaly_z)
+        print_report(aggregator.result(args.top_k, args.min_support, args.anomaly_z))
+        rejects = aggregator.rejects
+    elif args.checkpoint:
+        aggregator = scan_with_checkpoints(filename, args.checkpoint, args.workers, args.engine,
+                                           args.sketch_capacity, args.checkpoint_every)
+        print_report(aggregator.result(args.top_k))
+        rejects = aggregator.rejects
+    elif args.phase_stats or args.progress:
+        stats = PhaseStats(os.path.getsize(filename), args.progress)
+        aggregator = scan_instrumented(filename, args.engine, args.sketch_capacity, args.distinct,
+                                       args.failure_rates, stats)
+        print_report(aggregator.result(args.top_k, args.min_support, args.anomaly_z))
+        if args.phase_stats:
+            stats.report(aggregator)
+        rejects = aggregator.rejects
+    else:
+        aggregator = scan_file(filename, args.workers, args.engine, args.sketch_capacity,
+                               distinct=args.distinct, failures=args.failure_rates)
+        print_report(aggregator.result(args.top_k, args.min_support, args.anomaly_z))
+        rejects = aggregator.rejects
 
-# Get top K users
-top_users = heapq.nlargest(TOP_K, user_count.items(), key=lambda x: x[1])
+    if args.quarantine and rejects is not None:   # main() turns --quarantine away in the other modes
+        write_quarantine(args.quarantine, rejects)
 
-print("Top Users:")
-for user, count in top_users:
-    print(user, count)
 
-print("\nStats:")
-print("Total Users    :", len(user_count))
-print("Total Events   :", total_events)
-print("Failed Events  :", failed_events)
-print("Unique Actions :", len(actions))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import gzip
+import heapq
+import random
+from operator import itemgetter
+
+import pytest
+
+import log_processing_engine as engine
+
+SEED = 20260108
+LINES = 30000   # enough for many BLOCK_SIZE blocks and several gzip members
+BLOCK_SIZE = 1 << 16   # small blocks, so block edges, tail widths and tally switches get exercised
+GZIP_MEMBERS = 4
+TOP_K = 10   # deep enough to see how ties among top users are broken
+
+# Lines the parsers treat specially; {user} is filled in, the timestamp is put in front
+ODD_LINES = [
+    "corrupted line without proper format",
+    "|USER_ID={user}|ACTION=LOGIN|STATUS=FAIL",                      # no spaces
+    " | USER_ID=+{user} | ACTION=UPLOAD | STATUS=SUCCESS",
+    " | USER_ID=1_{user} | ACTION=UPLOAD | STATUS=SUCCESS",
+    " | USER_ID= {user} | ACTION= DELETE | STATUS= FAIL ",           # padded values
+    " | USER_ID=-{user} | ACTION=LOGIN | STATUS=FAIL",
+    " | USER_ID=abc | ACTION=LOGIN | STATUS=FAIL",                    # user_id
+    " | USER_ID=9223372036854775808 | ACTION=LOGIN | STATUS=FAIL",   # user_id, past int64
+    " | USER_ID={user} | ACTION | STATUS=FAIL",                       # action
+    " | USER_ID={user} | ACTION=LOGIN | STATUS",                      # status
+    " | USER_ID={user} | ACTION=LOGIN | STATUS=FAIL | EXTRA=1",       # field_count
+    " extra | USER_ID={user} | ACTION=LOGOUT | STATUS=FAIL",          # longer head
+    " | USER_ID={user} | ACTION=LOGIN | STATUS=FAIL\r",               # CRLF
+    "",
+    "a | b",                                                           # '|' inside the usual timestamp width
+]
+
+
+def make_lines(seed=SEED, count=LINES):
+    # Seeded corpus: canonical lines with a few repeating users in the first half and mostly
+    # distinct large ids in the second (so the mmap engine switches from tallying to reading
+    # line by line), about 1 in 10 lines odd; it starts with a broken line
+    rng = random.Random(seed)
+    lines = ["corrupted line without proper format"]
+    for n in range(count):
+        stamp = f"2026-01-08 {n // 3600 % 24:02}:{n // 60 % 60:02}:{n % 60:02}"
+        user = rng.randint(1, 50) if n < count // 2 else rng.randint(1, 10 ** 12)
+        if rng.random() < 0.1:
+            odd = rng.choice(ODD_LINES).format(user=user)
+            lines.append(odd if odd.startswith(("corrupted", "a |")) or not odd else stamp + odd)
+        else:
+            action = rng.choice(["LOGIN", "LOGOUT", "UPLOAD", "DOWNLOAD", "DELETE"])
+            status = rng.choice(["SUCCESS", "FAIL"])
+            lines.append(f"{stamp} | USER_ID={user} | ACTION={action} | STATUS={status}")
+    return [line + "\n" for line in lines]
+
+
+def reference(lines, top_k=TOP_K):
+    # The report fields as check_line reads the corpus, one line at a time
+    user_count = {}
+    actions = set()
+    total_events = failed_events = 0
+    rejects = dict.fromkeys(engine.REJECT_REASONS, 0)
+    for line in lines:
+        record, reason = engine.check_line(line)
+        if record is None:
+            rejects[reason] += 1
+            continue
+        user_id, action, status = record
+        user_count[user_id] = user_count.get(user_id, 0) + 1
+        actions.add(action)
+        total_events += 1
+        failed_events += status == "FAIL"
+    return {
+        "top_users": heapq.nlargest(top_k, user_count.items(), key=itemgetter(1)),
+        "total_users": len(user_count),
+        "total_events": total_events,
+        "failed_events": failed_events,
+        "unique_actions": len(actions),
+        "rejects": rejects,
+    }
+
+
+def report(summary):
+    # The fields of a result() summary that every engine reports
+    return {key: summary[key] for key in ("top_users", "total_users", "total_events", "failed_events",
+                                          "unique_actions", "rejects")}
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    # (plain log path, single-member .gz path, multi-member .gz path, expected report)
+    lines = make_lines()
+    data = "".join(lines).encode()
+    folder = tmp_path_factory.mktemp("logs")
+    plain = folder / "logs.txt"
+    plain.write_bytes(data)
+    single = folder / "logs.txt.gz"
+    single.write_bytes(gzip.compress(data))
+    # Members end mid-line, so the shards have lines to rejoin
+    multi = folder / "parts.txt.gz"
+    step = len(data) // GZIP_MEMBERS + 1
+    multi.write_bytes(b"".join(gzip.compress(data[i:i + step]) for i in range(0, len(data), step)))
+    return str(plain), str(single), str(multi), reference(lines)
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(engine, "BLOCK_SIZE", BLOCK_SIZE)
+
+
+def test_corpus_has_every_reject_reason(corpus):
+    rejects = corpus[3]["rejects"]
+    assert all(rejects[reason] for reason in engine.REJECT_REASONS), rejects
+
+
+@pytest.mark.parametrize("scan_engine", ["text", "mmap"])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_scan_matches_line_by_line(corpus, scan_engine, workers):
+    aggregator = engine.scan_file(corpus[0], workers, scan_engine)
+    assert report(aggregator.result(TOP_K)) == corpus[3]
+
+
+def test_numpy_matches_line_by_line(corpus):
+    pytest.importorskip("numpy")
+    rejects = engine.RejectCounter()
+    summary = engine.scan_numpy(corpus[0], TOP_K, rejects)
+    summary["rejects"] = rejects.counts
+    assert report(summary) == corpus[3]
+
+
+@pytest.mark.parametrize("member", [1, 2], ids=["single-member", "multi-member"])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_gzip_matches_line_by_line(corpus, member, workers):
+    aggregator = engine.scan_file(corpus[member], workers, "mmap")
+    assert report(aggregator.result(TOP_K)) == corpus[3]
+
+
+def test_gzip_split_at_members(corpus):
+    # The multi-member file really is split, so the rejoining of cut lines is tested above
+    assert len(engine.gzip_member_starts(corpus[2], 3)) > 1
+
+
+def test_instrumented_scan_matches(corpus):
+    aggregator = engine.scan_instrumented(corpus[0])
+    assert report(aggregator.result(TOP_K)) == corpus[3]
+
+
+def test_tail_tally_switches_to_lines(corpus):
+    # The second half of the corpus has tails that rarely repeat
+    tail_parser = engine.TailParser()
+    for block in engine.iter_mmap_blocks(corpus[0]):
+        for record in engine.iter_block_records(block, tail_parser):
+            pass
+        if tail_parser.line_blocks:
+            break
+    assert tail_parser.line_blocks